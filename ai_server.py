@@ -1,54 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from gemma_service import build_prompt, generate_with_gemma
-from pydantic import BaseModel
+from fastapi import FastAPI
+from gemma_service import backend, generate_with_gemma
 from pptx import Presentation
 import os
 import uuid
-import json
-import faiss
-import numpy as np
-import requests
 from bs4 import BeautifulSoup
-import PyPDF2
 import docx
 import re
 
-from sentence_transformers import SentenceTransformer
+from embedding_backends import EMBEDDING_BACKEND, get_embedder
+from extractive import rank_sentences
+from extraction import normalize_blocks, normalize_text, pdf_pages, read_text
+from knowledge_api import KnowledgeAPI
+from metrics import instrument, timed
+from model_client import MODEL_SERVER_URL, ModelClient
+from profiling import profile_requests
 
 
 app = FastAPI(title="AI Learning Assistant API")
+instrument(app)
+profile_requests(app)
 
-UPLOAD_FOLDER = "uploads"
-DATA_FOLDER = "data"
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
-
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-
-class QuestionRequest(BaseModel):
-    question: str
-
-
-class URLRequest(BaseModel):
-    url: str
-
-
-class GenerateRequest(BaseModel):
-    difficulty: str
-
-
-def save_json(data):
-    with open(f"{DATA_FOLDER}/knowledge.json", "w") as f:
-        json.dump(data, f, indent=4)
-
-
-def load_json():
-    path = f"{DATA_FOLDER}/knowledge.json"
-    if os.path.exists(path):
-        return json.load(open(path))
-    return []
+if MODEL_SERVER_URL:
+    # embeddings come from the shared model server (model_server.py)
+    model = ModelClient(MODEL_SERVER_URL)
+else:
+    # sentence-transformers, or ONNX Runtime with EMBEDDING_BACKEND=onnx
+    model = get_embedder(EMBEDDING_BACKEND)
 
 
 def simple_sentence_split(text):
@@ -56,32 +33,7 @@ def simple_sentence_split(text):
     return [s.strip() for s in sentences if s.strip()]
 
 
-def scrape_website(url):
-    headers = {"User-Agent": "MiniScraperBot/2.0"}
-
-    r = requests.get(url, headers=headers, timeout=30)
-    r.raise_for_status()
-
-    soup = BeautifulSoup(r.text, "html.parser")
-    texts = soup.find_all(text=True)
-
-    visible_text = []
-    for t in texts:
-        if t.parent.name not in ["script", "style", "meta", "noscript"]:
-            content = t.strip()
-            if content:
-                visible_text.append(content)
-
-    return {
-        "source_id": str(uuid.uuid4()),
-        "source_type": "website",
-        "source_path": url,
-        "content": " ".join(visible_text)
-    }
-
-
-import chardet
-
+@timed("extract")
 def load_file(path):
     ext = os.path.splitext(path)[1].lower()
     text = ""
@@ -89,14 +41,9 @@ def load_file(path):
     try:
 
         # ===== PDF EXTRACTION =====
+        # pages extracted in parallel (and cached) and cleaned as they arrive
         if ext == ".pdf":
-            with open(path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
+            text = normalize_blocks(page + "\n" for page in pdf_pages(path) if page)
 
         # ===== DOCX EXTRACTION =====
         elif ext == ".docx":
@@ -139,34 +86,14 @@ def load_file(path):
             text = "\n".join(parts)
 
         # ===== TEXT BASED FORMATS =====
-        elif ext in [".txt", ".csv", ".log", ".md", ".json", ".py", ".html", ".xml", ".rtf"]:
-
-            with open(path, "rb") as f:
-                raw = f.read()
-
-            detected = chardet.detect(raw)
-            encoding = detected.get("encoding", "utf-8")
-
-            text = raw.decode(encoding, errors="ignore")
-
-        # ===== LAST RESORT FALLBACK =====
+        # (and last resort fallback) decoded and cleaned in blocks
         else:
-            with open(path, "rb") as f:
-                raw = f.read()
-
-            detected = chardet.detect(raw)
-            encoding = detected.get("encoding", "utf-8")
-
-            text = raw.decode(encoding, errors="ignore")
+            text = read_text(path)
 
         # ===== CLEANUP PHASE =====
-        text = text.strip()
-
-        # Remove non-printable binary junk
-        text = re.sub(r"[^\x09\x0A\x0D\x20-\x7E\x80-\xFF]", " ", text)
-
-        # Collapse whitespace
-        text = re.sub(r"\s+", " ", text)
+        # Remove non-printable binary junk, collapse whitespace
+        if ext in [".docx", ".pptx", ".ppt"]:
+            text = normalize_text(text)
 
         # FINAL VALIDATION
         if len(text) < 20:
@@ -183,6 +110,29 @@ def load_file(path):
     }
 
 
+@timed("clean_text")
+def clean_text(text):
+    text = BeautifulSoup(text, "html.parser").get_text()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def answer_sentences(text):
+    return re.split(r'(?<=[.!?])\s+', clean_text(text))
+
+
+def make_chunk(text, rec):
+    return {
+        "text": text,
+        "source_type": rec["source_type"],
+        "source_path": rec["source_path"],
+        "source_id": rec["source_id"],
+        # cleaned and split once here instead of on every answer
+        "sentences": answer_sentences(text)
+    }
+
+
+@timed("chunking")
 def create_chunks_from_json(json_records, size=800):
     chunks = []
 
@@ -194,59 +144,29 @@ def create_chunks_from_json(json_records, size=800):
             if len(chunk) + len(s) <= size:
                 chunk += " " + s
             else:
-                chunks.append({
-                    "text": chunk.strip(),
-                    "source_type": rec["source_type"],
-                    "source_path": rec["source_path"]
-                })
+                chunks.append(make_chunk(chunk.strip(), rec))
                 chunk = s
 
         if chunk:
-            chunks.append({
-                "text": chunk.strip(),
-                "source_type": rec["source_type"],
-                "source_path": rec["source_path"]
-            })
+            chunks.append(make_chunk(chunk.strip(), rec))
 
     return chunks
 
 
-def build_vector_store(chunks):
-    texts = [c["text"] for c in chunks]
-    embeddings = model.encode(texts)
-
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(np.array(embeddings))
-
-    return index, chunks
-
+def format_answer(chunk_ids, kb, embedding):
+    # the sentences of the retrieved chunks that best match the question
+    ranked = rank_sentences(kb, chunk_ids, embedding, answer_sentences)
 
-def clean_text(text):
-    text = BeautifulSoup(text, "html.parser").get_text()
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-
-def ask_question(question, index, chunks):
-    q_emb = model.encode([question])
-    D, I = index.search(np.array(q_emb), k=3)
+    # sources are numbered in the order they are first cited
+    citations = {}
+    lines = []
+    for _, chunk, sentence in ranked:
+        n = citations.setdefault((chunk["source_type"], chunk["source_path"]), len(citations) + 1)
+        lines.append(f"- {sentence} [{n}]")
 
-    used_sources = set()
-    collected_text = []
+    answer = "\n".join(lines)
 
-    for i in I[0]:
-        chunk = chunks[i]
-        cleaned = clean_text(chunk["text"])
-        collected_text.append(cleaned)
-        used_sources.add((chunk["source_type"], chunk["source_path"]))
-
-    full_text = " ".join(collected_text)
-
-    sentences = re.split(r'(?<=[.!?])\s+', full_text)
-
-    answer = "\n".join(f"- {s}" for s in sentences[:6])
-
-    sources = "\n".join([f"{s.upper()}: {p}" for s, p in used_sources])
+    sources = "\n".join(f"[{n}] {s.upper()}: {p}" for (s, p), n in citations.items())
 
     return f"""
 ANSWER FROM KNOWLEDGE BASE:
@@ -258,94 +178,12 @@ SOURCES USED:
     """.strip()
 
 
-def generate_learning_material(chunks, difficulty, mode):
-
-    if not chunks:
-        return "No knowledge available to generate material."
-
-    combined = "\n".join([c["text"] for c in chunks[:3]])
-
-    prompt = build_prompt(combined, difficulty, mode)
-
-    result = generate_with_gemma(prompt)
-
-    return result
-
-
 @app.get("/")
 def home():
     return {"message": "AI Learning Assistant API Running"}
 
 
-@app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    path = os.path.join(UPLOAD_FOLDER, file.filename)
-
-    with open(path, "wb") as f:
-        f.write(await file.read())
-
-    rec = load_file(path)
-
-    data = load_json()
-    data.append(rec)
-    save_json(data)
-
-    return {"message": "File added to knowledge base"}
-
-
-@app.post("/scrape")
-def scrape(req: URLRequest):
-    try:
-        rec = scrape_website(req.url)
-
-        data = load_json()
-        data.append(rec)
-        save_json(data)
-
-        return {"message": "Website added to knowledge base"}
-
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-
-@app.post("/ask")
-def ask(req: QuestionRequest):
-    data = load_json()
-
-    if not data:
-        raise HTTPException(status_code=400, detail="No knowledge available")
-
-    chunks = create_chunks_from_json(data)
-    index, stored = build_vector_store(chunks)
-
-    answer = ask_question(req.question, index, stored)
-
-    return {"answer": answer}
-
-
-@app.post("/generate/worksheet")
-def worksheet(req: GenerateRequest):
-    data = load_json()
-
-    if not data:
-        raise HTTPException(status_code=400, detail="No knowledge available")
-
-    chunks = create_chunks_from_json(data)
-
-    result = generate_learning_material(chunks, req.difficulty, "worksheet")
-
-    return {"worksheet": result}
-
-
-@app.post("/generate/assessment")
-def assessment(req: GenerateRequest):
-    data = load_json()
-
-    if not data:
-        raise HTTPException(status_code=400, detail="No knowledge available")
-
-    chunks = create_chunks_from_json(data)
-
-    result = generate_learning_material(chunks, req.difficulty, "assessment")
-
-    return {"assessment": result}
+# the knowledge base, question and generation routes are shared with
+# backend/ai_local_server.py
+api = KnowledgeAPI(model, backend, generate_with_gemma, load_file, create_chunks_from_json, format_answer)
+app.include_router(api.router)
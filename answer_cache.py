@@ -0,0 +1,196 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+EXACT_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SEMANTIC_SIZE", "512"))
+
+# cosine similarity above which two questions share an answer
+SEMANTIC_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+def normalize_question(question):
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+class AnswerCache:
+    """
+    Two-tier cache of /ask answers.
+
+    The exact tier is an LRU keyed on the normalized question text.
+    The semantic tier keeps recent question embeddings and returns the
+    answer of the closest one if its cosine similarity is at least
+    `threshold`. Both tiers are dropped whenever the knowledge base
+    version changes.
+    """
+
+    def __init__(self, exact_size=EXACT_CACHE_SIZE,
+                 semantic_size=SEMANTIC_CACHE_SIZE,
+                 threshold=SEMANTIC_THRESHOLD):
+        self.exact_size = exact_size
+        self.semantic_size = semantic_size
+        self.threshold = threshold
+        self.lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        self._clear(None)
+
+    def _clear(self, version):
+        self.version = version
+        self.exact = OrderedDict()
+        self.vectors = None
+        self.answers = []
+        self.next_slot = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._clear(version)
+
+    def get(self, question, version):
+        key = normalize_question(question)
+
+        with self.lock:
+            self._check_version(version)
+
+            if key in self.exact:
+                self.exact.move_to_end(key)
+                self.exact_hits += 1
+                return self.exact[key]
+
+        return None
+
+    def get_similar(self, embedding, version):
+        vec = _unit(embedding)
+
+        with self.lock:
+            self._check_version(version)
+
+            if self.answers:
+                sims = self.vectors[:len(self.answers)] @ vec
+                best = int(np.argmax(sims))
+
+                if sims[best] >= self.threshold:
+                    self.semantic_hits += 1
+                    return self.answers[best]
+
+            self.misses += 1
+
+        return None
+
+    def put(self, question, embedding, answer, version):
+        key = normalize_question(question)
+
+        with self.lock:
+            if version != self.version:
+                # the knowledge base changed while this answer was computed
+                return
+
+            self.exact[key] = answer
+            self.exact.move_to_end(key)
+            if len(self.exact) > self.exact_size:
+                self.exact.popitem(last=False)
+
+            if self.semantic_size <= 0 or embedding is None:
+                return
+
+            vec = _unit(embedding)
+            if self.vectors is None:
+                self.vectors = np.zeros((self.semantic_size, vec.shape[0]), dtype="float32")
+
+            # ring buffer: the oldest entry is overwritten once full
+            slot = self.next_slot
+            self.vectors[slot] = vec
+            if slot < len(self.answers):
+                self.answers[slot] = answer
+            else:
+                self.answers.append(answer)
+            self.next_slot = (slot + 1) % self.semantic_size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+
+            return {
+                "version": self.version,
+                "exact_entries": len(self.exact),
+                "semantic_entries": len(self.answers),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "exact_hit_rate": self.exact_hits / lookups if lookups else 0.0,
+                "semantic_hit_rate": self.semantic_hits / lookups if lookups else 0.0,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "threshold": self.threshold
+            }
+
+
+def answer_with_cache(cache, kb, questions, format_answer):
+    """
+    Answers questions in input order. Each question is looked up in the
+    exact cache tier, then (after one shared encode) in the semantic
+    tier, and only the remaining ones are searched in a single batch.
+    `format_answer(chunk_ids, kb, embedding)` turns the search results
+    of a question and its embedding into an answer.
+    Returns (answer, cache tier or None, time in ms) per question.
+    """
+
+    version = kb.version
+    answers = [None] * len(questions)
+    tiers = [None] * len(questions)
+    times = [0.0] * len(questions)
+
+    for i, question in enumerate(questions):
+        t0 = time.perf_counter()
+        answers[i] = cache.get(question, version)
+        times[i] += (time.perf_counter() - t0) * 1000
+        if answers[i] is not None:
+            tiers[i] = "exact"
+
+    pending = [i for i, a in enumerate(answers) if a is None]
+    if not pending:
+        return list(zip(answers, tiers, times))
+
+    t0 = time.perf_counter()
+    embeddings = kb.encode([questions[i] for i in pending])
+    for i, emb in zip(pending, embeddings):
+        answers[i] = cache.get_similar(emb, version)
+        if answers[i] is not None:
+            tiers[i] = "semantic"
+    shared_ms = (time.perf_counter() - t0) * 1000 / len(pending)
+    for i in pending:
+        times[i] += shared_ms
+
+    rows = [n for n, i in enumerate(pending) if answers[i] is None]
+    if not rows:
+        return list(zip(answers, tiers, times))
+
+    search = [pending[n] for n in rows]
+
+    t0 = time.perf_counter()
+    ranked = kb.search_batch(
+        [questions[i] for i in search], k=3, embeddings=embeddings[rows]
+    )
+    shared_ms = (time.perf_counter() - t0) * 1000 / len(search)
+
+    for i, n, chunk_ids in zip(search, rows, ranked):
+        t0 = time.perf_counter()
+        answers[i] = format_answer(chunk_ids, kb, embeddings[n])
+        cache.put(questions[i], embeddings[n], answers[i], version)
+        times[i] += shared_ms + (time.perf_counter() - t0) * 1000
+
+    return list(zip(answers, tiers, times))
+
+
+def _unit(embedding):
+    vec = np.asarray(embedding, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
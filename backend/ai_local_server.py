@@ -1,64 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from gemma_service_local import build_prompt, generate_with_gemma
-from pydantic import BaseModel
-from pptx import Presentation
 import os
+import sys
+
+# shared modules live at the repo root next to ai_server.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from gemma_service_local import generate_with_gemma, llm_service
+from pptx import Presentation
 import uuid
-import json
-import faiss
-import numpy as np
-import requests
-from bs4 import BeautifulSoup
-import PyPDF2
 import docx
 import re
-import chardet
-from sentence_transformers import SentenceTransformer
+
+from embedding_backends import EMBEDDING_BACKEND, get_embedder
+from extractive import rank_sentences
+from extraction import normalize_blocks, normalize_text, pdf_pages, read_text
+from knowledge_api import KnowledgeAPI
+from metrics import instrument, timed
+from model_client import MODEL_SERVER_URL, ModelClient
+from profiling import profile_requests
 
 
 # =========================================================
 # APP INIT
 # =========================================================
 app = FastAPI(title="AI Learning Assistant API")
+instrument(app)
+profile_requests(app)
 
-UPLOAD_FOLDER = "uploads"
-DATA_FOLDER = "data"
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
-
-# local embedding model (still HuggingFace but lightweight)
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-
-
-# =========================================================
-# REQUEST MODELS
-# =========================================================
-class QuestionRequest(BaseModel):
-    question: str
-
-
-class URLRequest(BaseModel):
-    url: str
-
-
-class GenerateRequest(BaseModel):
-    difficulty: str
-
-
-# =========================================================
-# JSON STORAGE
-# =========================================================
-def save_json(data):
-    with open(f"{DATA_FOLDER}/knowledge.json", "w") as f:
-        json.dump(data, f, indent=4)
-
-
-def load_json():
-    path = f"{DATA_FOLDER}/knowledge.json"
-    if os.path.exists(path):
-        return json.load(open(path))
-    return []
+# local embedding model (still HuggingFace but lightweight),
+# or the copy owned by the shared model server
+if MODEL_SERVER_URL:
+    embed_model = ModelClient(MODEL_SERVER_URL)
+else:
+    embed_model = get_embedder(EMBEDDING_BACKEND)
 
 
 # =========================================================
@@ -69,37 +43,10 @@ def simple_sentence_split(text):
     return [s.strip() for s in sentences if s.strip()]
 
 
-# =========================================================
-# WEBSITE SCRAPER
-# =========================================================
-def scrape_website(url):
-
-    headers = {"User-Agent": "MiniScraperBot/2.0"}
-
-    r = requests.get(url, headers=headers, timeout=30)
-    r.raise_for_status()
-
-    soup = BeautifulSoup(r.text, "html.parser")
-    texts = soup.find_all(text=True)
-
-    visible_text = []
-    for t in texts:
-        if t.parent.name not in ["script", "style", "meta", "noscript"]:
-            content = t.strip()
-            if content:
-                visible_text.append(content)
-
-    return {
-        "source_id": str(uuid.uuid4()),
-        "source_type": "website",
-        "source_path": url,
-        "content": " ".join(visible_text)
-    }
-
-
 # =========================================================
 # FILE LOADER
 # =========================================================
+@timed("extract")
 def load_file(path):
 
     ext = os.path.splitext(path)[1].lower()
@@ -108,12 +55,9 @@ def load_file(path):
     try:
 
         # ---------- PDF ----------
+        # pages extracted in parallel (and cached) and cleaned as they arrive
         if ext == ".pdf":
-            with open(path, "rb") as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    if page.extract_text():
-                        text += page.extract_text() + "\n"
+            text = normalize_blocks((p + "\n" for p in pdf_pages(path) if p), strip_binary=False)
 
         # ---------- DOCX ----------
         elif ext == ".docx":
@@ -140,14 +84,12 @@ def load_file(path):
             text = "\n".join(parts)
 
         # ---------- TEXT ----------
+        # decoded and cleaned in blocks, charset detected on a sample
         else:
-            with open(path, "rb") as f:
-                raw = f.read()
+            text = read_text(path, strip_binary=False)
 
-            encoding = chardet.detect(raw)["encoding"] or "utf-8"
-            text = raw.decode(encoding, errors="ignore")
-
-        text = re.sub(r"\s+", " ", text).strip()
+        if ext in [".docx", ".pptx", ".ppt"]:
+            text = normalize_text(text, strip_binary=False)
 
         if len(text) < 20:
             text = "No readable educational content found."
@@ -166,6 +108,17 @@ def load_file(path):
 # =========================================================
 # CHUNKING
 # =========================================================
+def make_chunk(text, rec, sentences):
+
+    return {
+        "text": text,
+        "source_id": rec["source_id"],
+        "source_path": rec["source_path"],
+        "sentences": sentences
+    }
+
+
+@timed("chunking")
 def create_chunks_from_json(records, size=800):
 
     chunks = []
@@ -173,48 +126,46 @@ def create_chunks_from_json(records, size=800):
     for rec in records:
         sentences = simple_sentence_split(rec["content"])
         chunk = ""
+        # the sentences of a chunk are stored with it, so answers
+        # don't split them again
+        parts = []
 
         for s in sentences:
             if len(chunk) + len(s) <= size:
                 chunk += " " + s
+                parts.append(s)
             else:
-                chunks.append({"text": chunk.strip()})
+                chunks.append(make_chunk(chunk.strip(), rec, parts))
                 chunk = s
+                parts = [s]
 
         if chunk:
-            chunks.append({"text": chunk.strip()})
+            chunks.append(make_chunk(chunk.strip(), rec, parts))
 
     return chunks
 
 
-# =========================================================
-# VECTOR SEARCH
-# =========================================================
-def build_vector_store(chunks):
-
-    texts = [c["text"] for c in chunks]
-    embeddings = embed_model.encode(texts)
-
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(np.array(embeddings))
-
-    return index, chunks
-
-
 # =========================================================
 # QA SEARCH
 # =========================================================
-def ask_question(question, index, chunks):
+@timed("format_answer")
+def format_answer(chunk_ids, kb, embedding):
 
-    q_emb = embed_model.encode([question])
-    D, I = index.search(np.array(q_emb), k=3)
+    # the sentences of the retrieved chunks that best match the question
+    ranked = rank_sentences(kb, chunk_ids, embedding, simple_sentence_split)
 
-    collected = [chunks[i]["text"] for i in I[0]]
-    combined = " ".join(collected)
+    # sources are numbered in the order they are first cited; older
+    # chunks cite their source id, or nothing more specific
+    citations = {}
+    lines = []
+    for _, chunk, sentence in ranked:
+        source = chunk.get("source_path") or chunk.get("source_id") or "knowledge base"
+        n = citations.setdefault(source, len(citations) + 1)
+        lines.append(f"- {sentence} [{n}]")
 
-    sentences = re.split(r'(?<=[.!?])\s+', combined)
+    sources = "\n".join(f"[{n}] {source}" for source, n in citations.items())
 
-    return "\n".join(f"- {s}" for s in sentences[:6])
+    return "\n".join(lines) + "\n\nSources:\n" + sources
 
 
 # =========================================================
@@ -226,95 +177,8 @@ def home():
 
 
 # =========================================================
-# FILE UPLOAD
-# =========================================================
-@app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-
-    path = os.path.join(UPLOAD_FOLDER, file.filename)
-
-    with open(path, "wb") as f:
-        f.write(await file.read())
-
-    rec = load_file(path)
-
-    data = load_json()
-    data.append(rec)
-    save_json(data)
-
-    return {"message": "File added to knowledge base"}
-
-
-# =========================================================
-# SCRAPE
-# =========================================================
-@app.post("/scrape")
-def scrape(req: URLRequest):
-
-    try:
-        rec = scrape_website(req.url)
-
-        data = load_json()
-        data.append(rec)
-        save_json(data)
-
-        return {"message": "Website added"}
-
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-
-# =========================================================
-# ASK
+# KNOWLEDGE BASE, ASK AND GENERATION ROUTES
 # =========================================================
-@app.post("/ask")
-def ask(req: QuestionRequest):
-
-    data = load_json()
-    if not data:
-        raise HTTPException(status_code=400, detail="No knowledge available")
-
-    chunks = create_chunks_from_json(data)
-    index, stored = build_vector_store(chunks)
-
-    answer = ask_question(req.question, index, stored)
-
-    return {"answer": answer}
-
-
-# =========================================================
-# GENERATE WORKSHEET
-# =========================================================
-@app.post("/generate/worksheet")
-def worksheet(req: GenerateRequest):
-
-    data = load_json()
-    if not data:
-        raise HTTPException(status_code=400, detail="No knowledge available")
-
-    chunks = create_chunks_from_json(data)
-    combined = " ".join([c["text"] for c in chunks[:3]])
-
-    prompt = build_prompt(combined, req.difficulty, "worksheet")
-    result = generate_with_gemma(prompt)
-
-    return {"worksheet": result}
-
-
-# =========================================================
-# GENERATE ASSESSMENT
-# =========================================================
-@app.post("/generate/assessment")
-def assessment(req: GenerateRequest):
-
-    data = load_json()
-    if not data:
-        raise HTTPException(status_code=400, detail="No knowledge available")
-
-    chunks = create_chunks_from_json(data)
-    combined = " ".join([c["text"] for c in chunks[:3]])
-
-    prompt = build_prompt(combined, req.difficulty, "assessment")
-    result = generate_with_gemma(prompt)
-
-    return {"assessment": result}
+# shared with ai_server.py
+api = KnowledgeAPI(embed_model, llm_service, generate_with_gemma, load_file, create_chunks_from_json, format_answer)
+app.include_router(api.router)
@@ -0,0 +1,140 @@
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+
+from metrics import histogram, stage
+
+
+# queries slower than this are logged, with their parameters redacted
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+QUERY_SECONDS = histogram(
+    "shiksha_db_query_seconds", "Latency of each SQL statement.", ("statement",)
+)
+QUERY_ROWS = histogram(
+    "shiksha_db_rows", "Rows returned (SELECT) or affected (others) per statement.",
+    ("statement",), ROW_BUCKETS
+)
+REQUEST_QUERIES = histogram(
+    "shiksha_db_queries_per_request", "SQL statements run by each request, per route.",
+    ("path",), QUERY_COUNT_BUCKETS
+)
+
+log = logging.getLogger("shiksha.db")
+
+# [count] of the request being handled, a list so threadpool copies of
+# the context still update the same counter
+_request_queries = ContextVar("request_queries", default=None)
+
+
+def statement_label(sql):
+    # one series per statement, whatever the length of an IN (...) list
+    sql = " ".join(sql.split())
+    return re.sub(r"\(\s*%s(\s*,\s*%s)+\s*\)", "(%s, ...)", sql)
+
+
+def redact(params, many=False):
+    if params is None:
+        return None
+    if many:
+        return f"<{len(params)} rows>"
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    return [type(v).__name__ for v in params]
+
+
+class InstrumentedCursor:
+    """
+    Wraps a mysql-connector cursor and records the latency and row
+    count of every statement. Everything else is passed through.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._statement = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, **kwargs):
+        return self._run(self._cursor.execute, operation, params, False, kwargs)
+
+    def executemany(self, operation, seq_params, **kwargs):
+        return self._run(self._cursor.executemany, operation, seq_params, True, kwargs)
+
+    def _run(self, method, operation, params, many, kwargs):
+        self._statement = statement_label(operation)
+
+        start = time.perf_counter()
+        try:
+            with stage("db"):
+                result = method(operation, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            QUERY_SECONDS.observe(elapsed, self._statement)
+
+            count = _request_queries.get()
+            if count is not None:
+                count[0] += 1
+
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                log.warning("slow query (%.1f ms): %s params=%s",
+                            elapsed * 1000, self._statement, redact(params, many))
+
+        # SELECT rows are counted when fetched
+        if not getattr(self._cursor, "with_rows", False):
+            QUERY_ROWS.observe(max(self._cursor.rowcount, 0), self._statement)
+
+        return result
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        QUERY_ROWS.observe(len(rows), self._statement)
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        QUERY_ROWS.observe(0 if row is None else 1, self._statement)
+        return row
+
+
+class InstrumentedConnection:
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs))
+
+
+def count_queries(app):
+    """Records how many statements every request of `app` runs."""
+
+    @app.middleware("http")
+    async def record_queries(request, call_next):
+        count = [0]
+        token = _request_queries.set(count)
+
+        try:
+            response = await call_next(request)
+        finally:
+            _request_queries.reset(token)
+
+        route = request.scope.get("route")
+        if route:
+            REQUEST_QUERIES.observe(count[0], route.path)
+
+        return response
+
+    return app
@@ -1,16 +1,27 @@
+import os
+import sys
+
+# shared modules live at the repo root next to ai_server.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List
+import json
 import mysql.connector
+import requests
 import jwt
 from datetime import datetime, timedelta
 from fastapi.openapi.utils import get_openapi
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from db_metrics import InstrumentedConnection, count_queries
+from metrics import instrument
+from profiling import profile_requests
+
 cred = credentials.Certificate("shiksha-sahayak-9d71c-firebase-adminsdk-fbsvc-b791be5920.json")
 firebase_admin.initialize_app(cred)
 
@@ -21,7 +32,13 @@ SECRET_KEY = "your_super_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# AI server holding the batch generation jobs
+AI_SERVER_URL = os.environ.get("AI_SERVER_URL", "http://localhost:6000")
+
 app = FastAPI(title="Shiksa Sahayak Server")
+instrument(app)
+count_queries(app)
+profile_requests(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,13 +52,13 @@ security = HTTPBearer()
 
 
 def get_db():
-    return mysql.connector.connect(
+    return InstrumentedConnection(mysql.connector.connect(
         host="localhost",
         port=3316,
         user="root",
         password="",
         database="shiksha"
-    )
+    ))
 
 
 class Student(BaseModel):
@@ -67,6 +84,10 @@ class Worksheet(BaseModel):
 class DeleteWorksheet(BaseModel):
     wid: int
 
+class WorksheetsFromJob(BaseModel):
+    job_id: str
+    tid: int
+
 class AssessmentBulk(BaseModel):
     aid: int
     tid: int
@@ -246,6 +267,51 @@ def delete_worksheet(data: DeleteWorksheet, user=Depends(get_current_user)):
     cursor.close()
     return {"message": f"Deleted worksheet with WID {data.wid}"}
 
+@app.post("/worksheets/fromjob")
+def worksheets_from_job(data: WorksheetsFromJob, user=Depends(get_current_user)):
+    response = requests.get(f"{AI_SERVER_URL}/jobs/{data.job_id}", timeout=30)
+    if response.status_code == 404:
+        raise HTTPException(status_code=404, detail="Job not found")
+    response.raise_for_status()
+
+    job = response.json()
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+    worksheets = [r for r in job["results"] if r["status"] == "done" and r["spec"]["mode"] == "worksheet"]
+
+    db = get_db()
+    cursor = db.cursor()
+
+    # wids are taken from MAX(wid), two saves at once must not both read it
+    cursor.execute("LOCK TABLES worksheets WRITE")
+    try:
+        cursor.execute("SELECT COALESCE(MAX(wid), 0) FROM worksheets")
+        wid = cursor.fetchone()[0]
+
+        wids = []
+        for result in worksheets:
+            spec = result["spec"]
+            wid += 1
+            name = f"{spec['difficulty']} worksheet" + (f": {spec['topic']}" if spec["topic"] else "")
+            questions = result["output"]
+            if not isinstance(questions, str):
+                questions = json.dumps(questions)
+            wids.append((name, wid, questions, data.tid))
+
+        if wids:
+            cursor.executemany(
+                "INSERT INTO worksheets (name, wid, questions, tid) VALUES (%s,%s,%s,%s)",
+                wids
+            )
+
+        db.commit()
+    finally:
+        cursor.execute("UNLOCK TABLES")
+        cursor.close()
+
+    return {"message": f"Saved {len(wids)} worksheets", "wids": [w[1] for w in wids]}
+
 
 @app.post("/assessments/bulkcreate")
 def bulk_create_assessments(data: AssessmentBulk, user=Depends(get_current_user)):
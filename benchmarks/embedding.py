@@ -0,0 +1,153 @@
+"""
+Throughput of the embedding backends and how closely they agree with
+the PyTorch model, all run on the same texts:
+
+    python -m benchmarks.embedding --backends sentence_transformers onnx onnx_int8 --out embedding.json
+    python -m benchmarks.embedding --backends onnx_int8 --threads 1 2 4 --batch-sizes 16 64
+
+Each backend runs in its own process, so peak RSS is per backend. Every
+embedding is compared with the sentence_transformers one of the same
+text; the run fails if a backend's mean cosine similarity is below
+--min-cosine or its top-k neighbours differ too much from the reference.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+
+import numpy as np
+
+from embedding_backends import EMBEDDERS, get_embedder
+
+
+REFERENCE = "sentence_transformers"
+
+
+def sample_texts(path, count, chunk_chars):
+    """Sentences and chunk-sized passages of `path`, like queries and ingest."""
+
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        text = " ".join(f.read().split())
+
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if s]
+    passages = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+
+    return sentences[:count // 2] + passages[:count - count // 2]
+
+
+def run_backend(name, texts, repeats):
+    embedder = get_embedder(name)
+
+    # the first call initializes kernels and thread pools
+    embedder.encode(texts[:8])
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        vectors = embedder.encode(texts)
+        times.append(time.perf_counter() - start)
+
+    return {
+        "backend": name,
+        "load_s": embedder.load_seconds,
+        "texts_per_s": len(texts) / min(times),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "vectors": np.asarray(vectors, dtype="float32")
+    }
+
+
+def agreement(vectors, reference, k):
+    """Cosine similarity to the reference and overlap of top-k neighbours."""
+
+    a = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    b = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cosine = (a * b).sum(axis=1)
+
+    k = min(k, len(a) - 1)
+    if k < 1:
+        return float(cosine.mean()), float(cosine.min()), 1.0
+
+    # neighbours of every text among the others, under each model
+    sims_a = a @ a.T
+    sims_b = b @ b.T
+    np.fill_diagonal(sims_a, -np.inf)
+    np.fill_diagonal(sims_b, -np.inf)
+    top_a = np.argsort(-sims_a, axis=1)[:, :k]
+    top_b = np.argsort(-sims_b, axis=1)[:, :k]
+
+    overlap = np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)])
+
+    return float(cosine.mean()), float(cosine.min()), float(overlap)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDERS), choices=list(EMBEDDERS))
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--chunk-chars", type=int, default=800)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", nargs="+", type=int, default=[0],
+                        help="intra-op threads, 0 is the runtime default")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[32])
+    parser.add_argument("--k", type=int, default=10, help="neighbours compared for top-k overlap")
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--min-overlap", type=float, default=0.8)
+    parser.add_argument("--text", default="hello.txt", help="notes the texts are sampled from")
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    texts = sample_texts(args.text, args.texts, args.chunk_chars)
+
+    ctx = multiprocessing.get_context("spawn")
+
+    def run(name, threads, batch_size):
+        # spawned workers read these when importing embedding_backends
+        os.environ["EMBED_THREADS"] = str(threads)
+        os.environ["EMBED_BATCH_SIZE"] = str(batch_size)
+
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_backend, (name, texts, args.repeats))
+
+        result.update(threads=threads, batch_size=batch_size)
+        return result
+
+    reference = run(REFERENCE, args.threads[0], args.batch_sizes[0])["vectors"]
+
+    results = []
+    for name in args.backends:
+        for threads in args.threads:
+            for batch_size in args.batch_sizes:
+                result = run(name, threads, batch_size)
+                result["mean_cosine"], result["min_cosine"], result["topk_overlap"] = agreement(
+                    result.pop("vectors"), reference, args.k
+                )
+                results.append(result)
+
+    print(f"{'backend':<24}{'threads':>8}{'batch':>7}{'load s':>8}{'texts/s':>10}"
+          f"{'mean cos':>10}{'min cos':>9}{'top-k':>7}{'peak MB':>9}")
+    for r in results:
+        print(f"{r['backend']:<24}{r['threads'] or 'auto':>8}{r['batch_size']:>7}{r['load_s']:>8.1f}"
+              f"{r['texts_per_s']:>10.1f}{r['mean_cosine']:>10.4f}{r['min_cosine']:>9.4f}"
+              f"{r['topk_overlap']:>7.2f}{r['peak_rss_mb']:>9.0f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"texts": len(texts), "results": results}, f, indent=4)
+
+    failed = [
+        r["backend"] for r in results
+        if r["mean_cosine"] < args.min_cosine or r["topk_overlap"] < args.min_overlap
+    ]
+    if failed:
+        print(f"Disagrees with {REFERENCE}: {', '.join(sorted(set(failed)))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Load time, prefill and decode throughput and peak RSS of the
+generation backends, all run on the same prompts:
+
+    python -m benchmarks.generation --backends transformers llama_cpp --out generation.json
+    python -m benchmarks.generation --backends llama_cpp --speculative off lookup
+    python -m benchmarks.generation --backends transformers transformers_cpu --cpu-dtypes bf16 fp32 int8
+
+Each backend runs in its own process, so peak RSS is per backend.
+Prefill is timed as a 1-token generation of the prompt and decode as
+the rest of a full generation. With --speculative every backend runs
+once per SPECULATIVE_DECODING mode, reporting how many tokens each
+forward pass produced and, where drafts are counted, the acceptance rate.
+transformers_cpu runs once per --cpu-dtypes weight type, to compare
+against the fp16 transformers configuration on the same machine.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+from generation_backends import BACKENDS, CPU_DTYPES, accepted_tokens, build_prompt, get_backend
+
+
+DIFFICULTIES = ("Easy", "Medium", "Hard")
+
+
+def sample_prompts(path, count, content_chars):
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+
+    prompts = []
+    for i in range(count):
+        start = (i * content_chars) % max(len(text) - content_chars, 1)
+        mode = "worksheet" if i % 2 == 0 else "assessment"
+        prompts.append(build_prompt(text[start:start + content_chars], DIFFICULTIES[i % 3], mode))
+
+    return prompts
+
+
+def run_backend(name, prompts, max_new_tokens):
+    backend = get_backend(name)
+    mode = backend.speculative or "off"
+
+    runs = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        first = backend.generate_with_stats(prompt, 1)
+        prefill_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        full = backend.generate_with_stats(prompt, max_new_tokens)
+        total_s = time.perf_counter() - start
+
+        runs.append({
+            "prompt_tokens": first["prompt_tokens"],
+            "new_tokens": full["new_tokens"],
+            "prefill_s": prefill_s,
+            "decode_s": max(total_s - prefill_s, 1e-9),
+            "decode_passes": full.get("decode_passes"),
+            "draft_tokens": full.get("draft_tokens"),
+            "accepted_tokens": accepted_tokens(full)
+        })
+
+    prompt_tokens = sum(r["prompt_tokens"] for r in runs)
+    decode_tokens = sum(max(r["new_tokens"] - 1, 0) for r in runs)
+
+    tokens_per_pass = acceptance_rate = None
+    if all(r["decode_passes"] for r in runs):
+        tokens_per_pass = sum(r["new_tokens"] for r in runs) / sum(r["decode_passes"] for r in runs)
+    if all(r["draft_tokens"] is not None for r in runs) and sum(r["draft_tokens"] for r in runs):
+        acceptance_rate = sum(r["accepted_tokens"] for r in runs) / sum(r["draft_tokens"] for r in runs)
+
+    return {
+        "backend": name,
+        "speculative": mode,
+        "weights": backend.weights or "-",
+        "load_s": backend.load_seconds,
+        "prefill_tokens_per_s": prompt_tokens / sum(r["prefill_s"] for r in runs),
+        "decode_tokens_per_s": decode_tokens / sum(r["decode_s"] for r in runs),
+        "tokens_per_pass": tokens_per_pass,
+        "acceptance_rate": acceptance_rate,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "runs": runs
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["llama_cpp"],
+                        choices=[b for b in BACKENDS if b != "remote"])
+    parser.add_argument("--prompts", type=int, default=3)
+    parser.add_argument("--content-chars", type=int, default=2000)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--speculative", nargs="+", default=["off"],
+                        choices=["off", "lookup", "draft"])
+    parser.add_argument("--cpu-dtypes", nargs="+", default=["bf16"],
+                        choices=list(CPU_DTYPES), help="weights of transformers_cpu runs")
+    parser.add_argument("--text", default="hello.txt", help="notes the prompts are built from")
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    prompts = sample_prompts(args.text, args.prompts, args.content_chars)
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for name in args.backends:
+        dtypes = args.cpu_dtypes if name == "transformers_cpu" else [None]
+
+        for mode in args.speculative:
+            for dtype in dtypes:
+                # spawned workers read these when importing generation_backends
+                os.environ["SPECULATIVE_DECODING"] = "" if mode == "off" else mode
+                if dtype:
+                    os.environ["CPU_DTYPE"] = dtype
+
+                with ctx.Pool(1) as pool:
+                    results.append(pool.apply(run_backend, (name, prompts, args.max_new_tokens)))
+
+    def optional(value, width):
+        return f"{value:>{width}.2f}" if value is not None else f"{'-':>{width}}"
+
+    print(f"{'backend':<18}{'spec':<8}{'weights':<9}{'load s':>8}{'prefill tok/s':>15}{'decode tok/s':>14}"
+          f"{'tok/pass':>10}{'accept':>8}{'peak MB':>10}")
+    for r in results:
+        print(f"{r['backend']:<18}{r['speculative']:<8}{r['weights']:<9}{r['load_s']:>8.1f}{r['prefill_tokens_per_s']:>15.1f}"
+              f"{r['decode_tokens_per_s']:>14.1f}{optional(r['tokens_per_pass'], 10)}"
+              f"{optional(r['acceptance_rate'], 8)}{r['peak_rss_mb']:>10.0f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"prompts": len(prompts), "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
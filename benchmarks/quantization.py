@@ -0,0 +1,116 @@
+"""
+Memory and recall of the vector storage types in knowledge_base.py.
+
+Every storage type is built over the same vectors and compared against
+exact float32 search (storage "flat"):
+
+    python -m benchmarks.quantization --vectors 100000 --out quantization.json
+
+Vectors are synthetic clustered unit vectors by default. Pass --kb data
+(or data/namespaces/<name>) to measure on the embeddings of a real
+knowledge base, taken from its current generation.
+"""
+
+import argparse
+import json
+import time
+
+import os
+
+import faiss
+import numpy as np
+
+from knowledge_base import STORAGE_TYPES, new_vector_index
+
+
+def synthetic_embeddings(n, dim, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+
+    centers = rng.standard_normal((clusters, dim))
+    x = centers[rng.integers(clusters, size=n)] + 0.5 * rng.standard_normal((n, dim))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+
+    return x.astype("float32")
+
+
+def knowledge_base_embeddings(folder):
+    with open(os.path.join(folder, "CURRENT")) as f:
+        path = os.path.join(folder, "generations", f.read().strip(), "vector.index")
+
+    index = faiss.read_index(path)
+    if not isinstance(faiss.downcast_index(index), faiss.IndexIDMap2):
+        return index.reconstruct_n(0, index.ntotal)
+
+    # chunk ids of removed sources are gone, read the vectors underneath
+    mapped = faiss.downcast_index(index)
+    return faiss.downcast_index(mapped.index).reconstruct_n(0, index.ntotal)
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / (k * len(truth))
+
+
+def measure(storage, base, queries, truth, k):
+    index = new_vector_index(storage, base.shape[1])
+
+    t0 = time.perf_counter()
+    if not index.is_trained:
+        index.train(base)
+    train_s = time.perf_counter() - t0
+
+    index.add(base)
+
+    t0 = time.perf_counter()
+    D, I = index.search(queries, k)
+    query_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    nbytes = faiss.serialize_index(index).nbytes
+
+    return {
+        "storage": storage,
+        "bytes_per_vector": nbytes / len(base),
+        "mb_per_100k": nbytes / len(base) * 100000 / 2 ** 20,
+        f"recall_at_{k}": recall_at_k(I, truth),
+        "query_ms": query_ms,
+        "train_s": train_s
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--kb", help="knowledge base folder to take vectors from")
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    if args.kb:
+        vectors = knowledge_base_embeddings(args.kb)
+    else:
+        vectors = synthetic_embeddings(args.vectors + args.queries, args.dim)
+
+    queries, base = vectors[:args.queries], vectors[args.queries:]
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+
+    results = [measure(s, base, queries, truth, args.k) for s in STORAGE_TYPES]
+
+    print(f"{len(base)} vectors, dim {base.shape[1]}, {len(queries)} queries")
+    print(f"{'storage':<8}{'MB/100k':>10}{'recall@' + str(args.k):>12}{'query ms':>10}")
+    for r in results:
+        print(f"{r['storage']:<8}{r['mb_per_100k']:>10.1f}"
+              f"{r[f'recall_at_{args.k}']:>12.3f}{r['query_ms']:>10.3f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"vectors": len(base), "dim": base.shape[1], "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
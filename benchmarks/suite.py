@@ -0,0 +1,355 @@
+"""
+End-to-end benchmark of the AI server on synthetic corpora of
+increasing size: extraction, chunking, embedding, index build and
+/ask and /generate latency, all offline on CPU:
+
+    python -m benchmarks.suite --sizes 2 8 32 --out suite.json
+    python -m benchmarks.suite --sizes 2 8 32 --baseline suite.json
+
+Every document is the --text notes with shuffled sections and
+renumbered facts, written once per format (.txt, .pdf, .docx, .pptx).
+/generate uses the model-free stub backend unless --generation-backend
+picks a real one. Requests go through FastAPI's TestClient (needs
+httpx), and the embedding model must already be in the local Hugging
+Face cache. With --baseline the run fails if a metric got more than
+--tolerance worse.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORMATS = (".txt", ".pdf", ".docx", ".pptx")
+
+DIFFICULTIES = ("Easy", "Medium", "Hard")
+
+# metrics checked against --baseline, True where higher is better
+TRACKED = {
+    "extract_mb_per_s": True,
+    "chunk_s": False,
+    "embed_chunks_per_s": True,
+    "index_build_s": False,
+    "ask_p50_ms": False,
+    "ask_p99_ms": False,
+    "generate_p50_ms": False,
+    "generate_p99_ms": False,
+}
+
+
+# =========================================================
+# SYNTHETIC CORPUS
+# =========================================================
+def note_sections(path):
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+
+    return [s.strip() for s in text.split("---") if s.strip()]
+
+
+def synthesize_document(sections, rng):
+    text = "\n\n".join(rng.sample(sections, len(sections)))
+
+    # renumber the facts so documents don't collapse into duplicates
+    return re.sub(r"\d+", lambda m: str(int(m.group()) + rng.randint(0, 9)), text)
+
+
+def write_txt(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def write_pdf(path, text, lines_per_page=50):
+    """Minimal uncompressed PDF with Helvetica text pages."""
+
+    lines = text.splitlines() or [""]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    kids = []
+
+    for i in range(0, len(lines), lines_per_page):
+        ops = ["BT /F1 10 Tf 12 TL 40 800 Td"]
+        for line in lines[i:i + lines_per_page]:
+            line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({line}) Tj T*")
+        ops.append("ET")
+
+        stream = "\n".join(ops).encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+
+    refs = " ".join(f"{k} 0 R" for k in kids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (refs, len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_docx(path, text):
+    import docx
+
+    doc = docx.Document()
+    for para in text.split("\n\n"):
+        doc.add_paragraph(para)
+    doc.save(path)
+
+
+def write_pptx(path, text):
+    from pptx import Presentation
+
+    prs = Presentation()
+    for section in text.split("\n\n"):
+        title, _, body = section.partition("\n")
+
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = title
+        slide.placeholders[1].text = body
+
+    prs.save(path)
+
+
+WRITERS = {
+    ".txt": write_txt,
+    ".pdf": write_pdf,
+    ".docx": write_docx,
+    ".pptx": write_pptx,
+}
+
+
+def build_corpus(folder, sections, docs_per_format, rng):
+    os.makedirs(folder, exist_ok=True)
+
+    paths = []
+    for i in range(docs_per_format):
+        for ext in FORMATS:
+            path = os.path.join(folder, f"doc{i:05d}{ext}")
+            WRITERS[ext](path, synthesize_document(sections, rng))
+            paths.append(path)
+
+    return paths
+
+
+def sample_questions(chunks, count, rng):
+    # the opening words of a random sentence of a random chunk
+    questions = []
+    for _ in range(count):
+        sentences = re.split(r"(?<=[.!?])\s+", rng.choice(chunks)["text"])
+        words = rng.choice(sentences).split()[:8]
+        questions.append(" ".join(words).rstrip(".!?") + "?")
+
+    return questions
+
+
+# =========================================================
+# MEASUREMENTS
+# =========================================================
+def timed_requests(client, path, payloads):
+    # first request warms up lazy imports and the generation backend
+    client.post(path, json=payloads[0]).raise_for_status()
+
+    times = []
+    for payload in payloads:
+        start = time.perf_counter()
+        client.post(path, json=payload).raise_for_status()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def run_size(server, client, sections, docs_per_format, args, workdir):
+    from answer_cache import AnswerCache
+    from namespaces import DEFAULT_NAMESPACE, Namespaces
+
+    rng = random.Random(args.seed + docs_per_format)
+    paths = build_corpus(os.path.join(workdir, f"corpus-{docs_per_format}"),
+                         sections, docs_per_format, rng)
+
+    extraction = {}
+    records = []
+    for ext in FORMATS:
+        files = [p for p in paths if p.endswith(ext)]
+        mb = sum(os.path.getsize(p) for p in files) / 2 ** 20
+
+        start = time.perf_counter()
+        records += [server.load_file(p) for p in files]
+        elapsed = time.perf_counter() - start
+
+        extraction[ext[1:]] = {"files": len(files), "mb": mb, "s": elapsed, "mb_per_s": mb / elapsed}
+
+    start = time.perf_counter()
+    chunks = server.create_chunks_from_json(records)
+    chunk_s = time.perf_counter() - start
+
+    # endpoints read this attribute; no caching so every /ask does the work
+    server.api.namespaces = Namespaces(
+        os.path.join(workdir, f"kb-{docs_per_format}"), server.model,
+        cache=lambda: AnswerCache(exact_size=0, semantic_size=0)
+    )
+    kb = server.api.namespaces.get(DEFAULT_NAMESPACE)
+
+    start = time.perf_counter()
+    embeddings = kb.encode([c["text"] for c in chunks])
+    embed_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    kb.add_chunks(chunks, embeddings)
+    index_build_s = time.perf_counter() - start
+
+    questions = sample_questions(chunks, args.questions, rng)
+    ask_p50, ask_p99 = timed_requests(client, "/ask", [{"question": q} for q in questions])
+
+    generate_p50, generate_p99 = timed_requests(client, "/generate/worksheet", [
+        {"difficulty": DIFFICULTIES[i % 3], "topic": q}
+        for i, q in enumerate(questions[:args.generations])
+    ])
+
+    total_mb = sum(e["mb"] for e in extraction.values())
+
+    return {
+        "docs_per_format": docs_per_format,
+        "documents": len(paths),
+        "chunks": len(chunks),
+        "corpus_mb": total_mb,
+        "extraction": extraction,
+        "extract_mb_per_s": total_mb / sum(e["s"] for e in extraction.values()),
+        "chunk_s": chunk_s,
+        "embed_chunks_per_s": len(chunks) / embed_s,
+        "index_build_s": index_build_s,
+        "ask_p50_ms": ask_p50,
+        "ask_p99_ms": ask_p99,
+        "generate_p50_ms": generate_p50,
+        "generate_p99_ms": generate_p99,
+    }
+
+
+def compare(results, baseline, tolerance):
+    previous = {r["docs_per_format"]: r for r in baseline["sizes"]}
+
+    regressions = []
+    for r in results:
+        old = previous.get(r["docs_per_format"])
+        if not old:
+            continue
+
+        for metric, higher_is_better in TRACKED.items():
+            if not old.get(metric):
+                continue
+
+            change = r[metric] / old[metric] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(
+                    f"{metric} at {r['docs_per_format']} docs/format: "
+                    f"{old[metric]:.3f} -> {r[metric]:.3f} ({change:+.0%})"
+                )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 8, 32],
+                        help="documents per format in each corpus")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--generation-backend", default="stub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--text", default="hello.txt", help="notes the corpora are built from")
+    parser.add_argument("--workdir", help="keep corpora and indexes here instead of a temp dir")
+    parser.add_argument("--baseline", help="earlier --out file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    sections = note_sections(args.text)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="shiksha-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    # the server creates data/ and uploads/ in the working directory on import
+    os.environ["GENERATION_BACKEND"] = args.generation_backend
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+
+    try:
+        from fastapi.testclient import TestClient
+
+        start = time.perf_counter()
+        server = importlib.import_module("ai_server")
+        startup_s = time.perf_counter() - start
+
+        client = TestClient(server.app)
+        results = [run_size(server, client, sections, n, args, workdir) for n in args.sizes]
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'docs':>6}{'chunks':>8}{'extract MB/s':>14}{'embed ch/s':>12}{'index s':>9}"
+          f"{'ask p50':>9}{'ask p99':>9}{'gen p50':>9}{'gen p99':>9}")
+    for r in results:
+        print(f"{r['documents']:>6}{r['chunks']:>8}{r['extract_mb_per_s']:>14.2f}"
+              f"{r['embed_chunks_per_s']:>12.1f}{r['index_build_s']:>9.2f}"
+              f"{r['ask_p50_ms']:>9.1f}{r['ask_p99_ms']:>9.1f}"
+              f"{r['generate_p50_ms']:>9.1f}{r['generate_p99_ms']:>9.1f}")
+
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version()
+        },
+        "generation_backend": args.generation_backend,
+        "startup_s": startup_s,
+        "sizes": results
+    }
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+import embedding_backends
+from extractive import pack_vectors
+from metrics import stage
+
+
+# processes embedding chunks, each with its own copy of the model and
+# an equal share of the cores
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+
+# chunks embedded and staged together; with one window embedding
+# while the previous is staged, only two windows of chunks are in memory
+INGEST_WINDOW = int(os.environ.get("INGEST_WINDOW", "2048"))
+
+# chunks per worker task, cut from a window sorted by length
+INGEST_SHARD = 128
+
+
+def embed_chunks(model, chunks):
+    """
+    Embeddings of `chunks` and the packed vectors of their sentences,
+    encoded in one call so the model batches them together.
+    """
+
+    texts = [c["text"] for c in chunks]
+    sentences = [c.get("sentences") or [] for c in chunks]
+
+    vectors = np.asarray(
+        model.encode(texts + [s for group in sentences for s in group]), dtype="float32"
+    )
+
+    packed = []
+    start = len(texts)
+    for group in sentences:
+        packed.append(pack_vectors(vectors[start:start + len(group)]) if group else None)
+        start += len(group)
+
+    return vectors[:len(texts)], packed
+
+
+_worker_model = None
+
+
+def _init_worker(backend, threads):
+    global _worker_model
+
+    embedding_backends.EMBED_THREADS = threads
+    _worker_model = embedding_backends.get_embedder(backend)
+
+
+def _embed_shard(chunks):
+    return embed_chunks(_worker_model, chunks)
+
+
+def _windows(chunks, size):
+    chunks = iter(chunks)
+    while True:
+        window = list(islice(chunks, size))
+        if not window:
+            return
+        yield window
+
+
+class BulkEmbedder:
+    """
+    Embeds a stream of chunks across a pool of worker processes.
+
+    Chunks are taken INGEST_WINDOW at a time. Each window is sorted by
+    length and cut into shards, so every model batch holds texts of
+    similar length and little padding. Windows come back in input
+    order as (chunks, embeddings), ready for KnowledgeBase.add_batches,
+    with their sentence vectors attached. `progress(done)` is called
+    with the number of chunks embedded so far.
+
+    With `workers` 0 (or a model server doing the embedding) chunks
+    are encoded in this process with `model` instead.
+    """
+
+    def __init__(self, model, workers=INGEST_WORKERS, backend=None, progress=None):
+        self.model = model
+        self.workers = workers
+        self.backend = backend or embedding_backends.EMBEDDING_BACKEND
+        self.progress = progress or (lambda done: None)
+
+    def _submit(self, pool, window):
+        order = sorted(range(len(window)), key=lambda i: -len(window[i]["text"]))
+        shards = [order[i:i + INGEST_SHARD] for i in range(0, len(order), INGEST_SHARD)]
+
+        futures = [pool.submit(_embed_shard, [window[i] for i in shard]) for shard in shards]
+        return window, shards, futures
+
+    def _collect(self, window, shards, futures):
+        embeddings = None
+
+        for shard, future in zip(shards, futures):
+            vectors, packed = future.result()
+
+            if embeddings is None:
+                embeddings = np.zeros((len(window), vectors.shape[1]), dtype="float32")
+            embeddings[shard] = vectors
+
+            for i, p in zip(shard, packed):
+                if p is not None:
+                    window[i]["sentence_vectors"] = p
+
+        return window, embeddings
+
+    def embed(self, chunks):
+        done = 0
+
+        if not self.workers:
+            for window in _windows(chunks, INGEST_WINDOW):
+                with stage("bulk_embed"):
+                    embeddings, packed = embed_chunks(self.model, window)
+                for chunk, p in zip(window, packed):
+                    if p is not None:
+                        chunk["sentence_vectors"] = p
+
+                done += len(window)
+                self.progress(done)
+                yield window, embeddings
+            return
+
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+
+        # spawned, forking a server process with model threads is unsafe
+        with ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.backend, threads)
+        ) as pool:
+            # the next window is embedding while the previous one is staged
+            pending = deque()
+
+            for window in _windows(chunks, INGEST_WINDOW):
+                pending.append(self._submit(pool, window))
+
+                if len(pending) > 1:
+                    batch = self._collect(*pending.popleft())
+                    done += len(batch[0])
+                    self.progress(done)
+                    yield batch
+
+            while pending:
+                batch = self._collect(*pending.popleft())
+                done += len(batch[0])
+                self.progress(done)
+                yield batch
+
+
+class BulkIngests:
+    """
+    Bulk ingests run in background threads. Their progress is a JSON
+    file in `folder`, so any worker can report it.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, ingest_id):
+        return os.path.join(self.folder, f"{ingest_id}.json")
+
+    def _save(self, ingest):
+        tmp = self._path(ingest["ingest_id"]) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(ingest, f)
+        os.replace(tmp, self._path(ingest["ingest_id"]))
+
+    def get(self, ingest_id):
+        if not re.fullmatch(r"[0-9a-f]{32}", ingest_id):
+            return None
+
+        try:
+            with open(self._path(ingest_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def start(self, kb, paths, load, chunk, save, embedder):
+        """
+        Ingests the files at `paths` into `kb`: `load(path)` extracts a
+        record, `chunk(records)` splits records into chunks and
+        `save(records)` stores the records once all are indexed. Until
+        then records wait on disk, `save` gets them as an iterator.
+        """
+
+        ingest = {
+            "ingest_id": uuid.uuid4().hex,
+            "status": "running",
+            "files": len(paths),
+            "files_done": 0,
+            "chunks_done": 0,
+            "started": time.time(),
+            "finished": None,
+            "error": None
+        }
+        self._save(ingest)
+
+        threading.Thread(
+            target=self._run, args=(ingest, kb, paths, load, chunk, save, embedder), daemon=True
+        ).start()
+
+        return ingest
+
+    def _run(self, ingest, kb, paths, load, chunk, save, embedder):
+        records_path = os.path.join(self.folder, f"{ingest['ingest_id']}.records.jsonl")
+
+        def chunks():
+            with open(records_path, "w") as records:
+                for path in paths:
+                    rec = load(path)
+                    records.write(json.dumps(rec) + "\n")
+                    yield from chunk([rec])
+
+                    ingest["files_done"] += 1
+                    self._save(ingest)
+
+        def progress(done):
+            ingest["chunks_done"] = done
+            self._save(ingest)
+
+        embedder.progress = progress
+
+        try:
+            kb.add_batches(embedder.embed(chunks()))
+            save(_read_records(records_path))
+            ingest["status"] = "done"
+        except Exception as e:
+            ingest.update(status="error", error=str(e))
+        finally:
+            if os.path.exists(records_path):
+                os.remove(records_path)
+
+        ingest["finished"] = time.time()
+        self._save(ingest)
+
+
+def _read_records(path):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
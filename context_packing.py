@@ -0,0 +1,69 @@
+from itertools import islice
+
+
+# chunks considered for one prompt, in rank (or ingest) order
+CONTEXT_CANDIDATES = 20
+
+# content tokens beyond this add prefill time without helping the generator
+MAX_CONTEXT_TOKENS = 1200
+
+# without a topic nothing is ranked, so only the first few chunks
+# (~600 tokens) are worth their prefill time
+NO_TOPIC_CHUNKS = 3
+
+# chat template markers and separators around the prompt
+PROMPT_OVERHEAD_TOKENS = 16
+
+
+def context_budget(context_size, max_new_tokens, template_tokens):
+    """
+    Tokens left for CONTENT once the prompt template and the answer
+    have their room in the model's context window.
+    """
+
+    room = context_size - max_new_tokens - template_tokens - PROMPT_OVERHEAD_TOKENS
+    return max(0, min(MAX_CONTEXT_TOKENS, room))
+
+
+def pack_context(texts, budget, count_tokens):
+    """
+    Greedily packs texts, best first, while they fit in `budget` tokens.
+    A text that doesn't fit is skipped so a shorter one further down
+    can still use the space. If not even the first text fits it is
+    cut down to the budget, so the prompt is never silently truncated
+    by the model instead.
+    """
+
+    if not texts or budget <= 0:
+        return ""
+
+    counts = count_tokens(texts)
+    packed = []
+    used = 0
+
+    for text, n in zip(texts, counts):
+        if used + n <= budget:
+            packed.append(text)
+            used += n + 1  # newline separator
+
+    if not packed:
+        text, n = texts[0], counts[0]
+        packed.append(text[:int(len(text) * budget / n)])
+
+    return "\n".join(packed)
+
+
+def select_context(kb, budget, count_tokens, topic=None):
+    """
+    CONTENT for a generator prompt: the chunks most relevant to `topic`
+    when one is given, otherwise the first NO_TOPIC_CHUNKS chunks of
+    the knowledge base, packed into `budget` tokens.
+    """
+
+    if topic:
+        ranked = kb.search(topic, k=CONTEXT_CANDIDATES)
+        texts = [kb.chunks[i]["text"] for i in ranked]
+    else:
+        texts = [c["text"] for c in islice(kb.chunks, NO_TOPIC_CHUNKS)]
+
+    return pack_context(texts, budget, count_tokens)
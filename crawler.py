@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+from urllib.parse import urldefrag, urljoin, urlparse, urlunparse
+from urllib.robotparser import RobotFileParser
+
+import httpx
+from bs4 import BeautifulSoup
+
+from metrics import stage
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+USER_AGENT = "MiniScraperBot/2.0"
+
+# pages fetched at once, also the size of the connection pool
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "8"))
+
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", "200"))
+
+MAX_CRAWL_DEPTH = 3
+
+FETCH_TIMEOUT = 30
+
+HIDDEN_TAGS = ["script", "style", "meta", "noscript"]
+
+
+def parse_html(html):
+    """Visible text and link targets of a page."""
+
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    links = [a["href"] for a in soup.find_all("a", href=True)]
+
+    for tag in soup(HIDDEN_TAGS):
+        tag.decompose()
+
+    return " ".join(soup.stripped_strings), links
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+INDEX_PAGES = ("index.html", "index.htm")
+
+
+def normalize_url(url):
+    """
+    The form of `url` used to tell pages apart: no fragment, lowercase
+    scheme and host, no default port, and "/docs/", "/docs" and
+    "/docs/index.html" all as "/docs".
+    """
+
+    parts = urlparse(urldefrag(url)[0])
+    scheme = parts.scheme.lower()
+
+    netloc = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{parts.port}"
+
+    path = parts.path
+    if path.rsplit("/", 1)[-1].lower() in INDEX_PAGES:
+        path = path.rsplit("/", 1)[0]
+    path = path.rstrip("/") or "/"
+
+    return urlunparse((scheme, netloc, path, parts.params, parts.query, ""))
+
+
+def load_cache(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_cache(path, cache):
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f)
+    os.replace(path + ".tmp", path)
+
+
+class Crawl:
+    """
+    One crawl from `start`: breadth-first, `depth` links deep, over a
+    pooled async client.
+
+    Beyond the start page (depth > 0) only pages of the same host that
+    its robots.txt allows are followed. `cache` maps URLs to their
+    ETag, Last-Modified and links; pages in `indexed` are requested
+    conditionally and come back unchanged on a 304.
+    """
+
+    def __init__(self, start, depth, cache, indexed, max_pages, client):
+        self.start = start
+        self.depth = depth
+        self.cache = cache
+        self.indexed = indexed
+        self.max_pages = max_pages
+        self.client = client
+
+        self.host = urlparse(start).hostname
+        self.slots = asyncio.Semaphore(CRAWL_CONCURRENCY)
+        self.robots = {}
+
+    async def _load_robots(self, origin):
+        parser = RobotFileParser(origin + "/robots.txt")
+
+        try:
+            async with self.slots:
+                response = await self.client.get(origin + "/robots.txt")
+        except httpx.HTTPError:
+            parser.disallow_all = True
+            return parser
+
+        # RFC 9309: no robots.txt allows everything, a failing server nothing
+        if response.status_code >= 500:
+            parser.disallow_all = True
+        elif response.status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(response.text.splitlines())
+
+        return parser
+
+    async def allowed(self, url):
+        if not self.depth:
+            # a single page is fetched on the user's behalf, like a browser
+            return True
+
+        parts = urlparse(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+
+        if origin not in self.robots:
+            self.robots[origin] = asyncio.ensure_future(self._load_robots(origin))
+
+        return (await self.robots[origin]).can_fetch(USER_AGENT, url)
+
+    async def fetch(self, url):
+        headers = {}
+        entry = self.cache.get(url)
+
+        if entry and url in self.indexed:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        async with self.slots:
+            response = await self.client.get(url, headers=headers)
+
+        if response.status_code == 304 and entry:
+            return {"url": url, "changed": False, "content": None, "links": entry["links"]}
+
+        response.raise_for_status()
+
+        # linked PDFs, images etc. are not followed
+        if url != self.start and "html" not in response.headers.get("content-type", "text/html"):
+            raise ValueError(f"Not an HTML page: {url}")
+
+        with stage("parse_html"):
+            content, links = parse_html(response.text)
+
+        self.cache[url] = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "links": links
+        }
+
+        return {"url": url, "changed": True, "content": content, "links": links}
+
+    async def visit(self, url):
+        # pages past the start page are skipped when they fail
+        try:
+            if not await self.allowed(url):
+                return None
+            return await self.fetch(url)
+        except (httpx.HTTPError, ValueError):
+            if url == self.start:
+                raise
+            return None
+
+    def follow(self, page, seen):
+        found = []
+
+        for href in page["links"]:
+            url = urldefrag(urljoin(page["url"], href))[0]
+            parts = urlparse(url)
+
+            if parts.scheme not in ("http", "https") or parts.hostname != self.host:
+                continue
+
+            # pages are fetched as linked, so relative links resolve
+            key = normalize_url(url)
+            if key in seen or len(seen) >= self.max_pages:
+                continue
+
+            seen.add(key)
+            found.append(url)
+
+        return found
+
+    async def run(self):
+        seen = {normalize_url(self.start)}
+        frontier = [self.start]
+        pages = []
+
+        for level in range(self.depth + 1):
+            results = await asyncio.gather(*(self.visit(url) for url in frontier))
+
+            frontier = []
+            for page in results:
+                if page is None:
+                    continue
+                pages.append(page)
+                if level < self.depth:
+                    frontier += self.follow(page, seen)
+
+        return pages
+
+
+async def crawl_async(url, depth=0, cache=None, indexed=(), max_pages=CRAWL_MAX_PAGES, client=None):
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=FETCH_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=CRAWL_CONCURRENCY, max_keepalive_connections=CRAWL_CONCURRENCY
+            )
+        )
+
+    try:
+        crawl = Crawl(url, depth, {} if cache is None else cache, set(indexed), max_pages, client)
+        return await crawl.run()
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+def crawl(url, depth=0, cache_path=None, indexed=(), max_pages=CRAWL_MAX_PAGES):
+    """
+    Fetches `url` and, with `depth`, the same-host pages it links to.
+    Returns [{url, changed, content, links}]; content is None for
+    pages unchanged since the cached ETag / Last-Modified.
+    """
+
+    if not 0 <= depth <= MAX_CRAWL_DEPTH:
+        raise ValueError(f"Crawl depth must be between 0 and {MAX_CRAWL_DEPTH}")
+
+    cache = load_cache(cache_path)
+
+    pages = asyncio.run(crawl_async(url, depth, cache, indexed, max_pages))
+
+    if cache_path:
+        save_cache(cache_path, cache)
+
+    return pages
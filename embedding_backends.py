@@ -0,0 +1,189 @@
+import functools
+import os
+import time
+
+import numpy as np
+
+from metrics import MODEL_LOAD_SECONDS
+
+
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBED_HF_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# "sentence_transformers" (eager PyTorch), "onnx" (ONNX Runtime, fp32)
+# or "onnx_int8" (ONNX Runtime, dynamically quantized int8 weights)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "sentence_transformers")
+
+# the exported model and its tokenizer, written on first use
+EMBED_ONNX_DIR = os.environ.get("EMBED_ONNX_DIR", os.path.join("models", "all-MiniLM-L6-v2-onnx"))
+
+# intra-op threads, 0 leaves the runtime default (one per core)
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", "0"))
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))
+
+# sentence-transformers truncates this model at 256 tokens
+EMBED_MAX_TOKENS = 256
+
+
+class SentenceTransformerEmbedder:
+
+    name = "sentence_transformers"
+
+    def load(self):
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        if EMBED_THREADS:
+            torch.set_num_threads(EMBED_THREADS)
+
+        self.model = SentenceTransformer(EMBED_MODEL_NAME)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        return np.asarray(
+            self.model.encode(texts, batch_size=EMBED_BATCH_SIZE), dtype="float32"
+        )
+
+
+def export_onnx(folder, quantized):
+    """
+    Path of the ONNX export of the embedding model under `folder`,
+    exporting it (and its int8 copy if `quantized`) the first time.
+    """
+
+    fp32_path = os.path.join(folder, "model.onnx")
+    int8_path = os.path.join(folder, "model-int8.onnx")
+
+    # several workers may export at once, each writes its own file
+    tmp_suffix = f".{os.getpid()}.tmp.onnx"
+
+    if not os.path.exists(fp32_path):
+        from transformers import AutoModel, AutoTokenizer
+        import torch
+
+        print("🔄 Exporting embedding model to ONNX...")
+
+        tokenizer = AutoTokenizer.from_pretrained(EMBED_HF_MODEL)
+        model = AutoModel.from_pretrained(EMBED_HF_MODEL).eval()
+        model.config.return_dict = False
+
+        os.makedirs(folder, exist_ok=True)
+        tokenizer.save_pretrained(folder)
+
+        sample = tokenizer(["An example sentence."], return_tensors="pt")
+        names = ["input_ids", "attention_mask", "token_type_ids"]
+        axes = {0: "batch", 1: "sequence"}
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[n] for n in names),
+                fp32_path + tmp_suffix,
+                input_names=names,
+                output_names=["last_hidden_state", "pooler_output"],
+                dynamic_axes={**{n: axes for n in names}, "last_hidden_state": axes},
+                opset_version=14
+            )
+        os.replace(fp32_path + tmp_suffix, fp32_path)
+
+    if not quantized:
+        return fp32_path
+
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # int8 weights, activations quantized per batch at run time
+        quantize_dynamic(fp32_path, int8_path + tmp_suffix, weight_type=QuantType.QInt8)
+        os.replace(int8_path + tmp_suffix, int8_path)
+
+    return int8_path
+
+
+class OnnxEmbedder:
+    """
+    The embedding model on ONNX Runtime: the exported transformer plus
+    the mean pooling and normalization sentence-transformers applies,
+    so its vectors can be searched against indexes built with either.
+    """
+
+    name = "onnx"
+
+    def __init__(self, quantized=False):
+        self.quantized = quantized
+        if quantized:
+            self.name = "onnx_int8"
+
+    def load(self):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(EMBED_ONNX_DIR, self.quantized)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if EMBED_THREADS:
+            options.intra_op_num_threads = EMBED_THREADS
+
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(EMBED_ONNX_DIR)
+
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _encode_batch(self, texts):
+        inputs = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=EMBED_MAX_TOKENS, return_tensors="np"
+        )
+        feed = {n: inputs[n].astype("int64") for n in self.input_names}
+
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+
+        mask = feed["attention_mask"][:, :, None].astype("float32")
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+
+        # texts of similar length share a batch, so little is padding
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            rows = order[start:start + EMBED_BATCH_SIZE]
+            out[rows] = self._encode_batch([texts[i] for i in rows])
+
+        return out
+
+
+EMBEDDERS = {
+    "sentence_transformers": SentenceTransformerEmbedder,
+    "onnx": OnnxEmbedder,
+    "onnx_int8": functools.partial(OnnxEmbedder, quantized=True),
+}
+
+_loaded = {}
+
+
+def get_embedder(name):
+    """Returns the loaded embedding backend `name`, loading it on first use."""
+
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+
+    if name not in _loaded:
+        embedder = EMBEDDERS[name]()
+
+        start = time.perf_counter()
+        embedder.load()
+        embedder.load_seconds = time.perf_counter() - start
+        MODEL_LOAD_SECONDS.set(embedder.load_seconds, f"embedding:{name}")
+
+        _loaded[name] = embedder
+
+    return _loaded[name]
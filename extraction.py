@@ -0,0 +1,286 @@
+import codecs
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from chardet.universaldetector import UniversalDetector
+
+
+# charset detection looks at most this much of a file, and stops
+# earlier once chardet is confident
+DETECT_SAMPLE_BYTES = 256 * 1024
+
+READ_BLOCK_BYTES = 1024 * 1024
+
+# "pypdfium2" (several times faster, pip install pypdfium2) or
+# "pypdf2"; "auto" picks pypdfium2 when it is installed
+PDF_ENGINE = os.environ.get("PDF_ENGINE", "auto")
+
+# processes extracting PDF pages, each takes PDF_PAGES_PER_TASK pages
+# at a time; shorter documents are extracted in the calling process
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = 8
+PDF_PARALLEL_MIN_PAGES = 32
+
+# extracted pages by document hash, so re-uploads skip extraction; the
+# least recently used documents are evicted beyond PDF_CACHE_MAX_MB
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", os.path.join("data", "pdf_cache"))
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+NON_PRINTABLE = re.compile(r"[^\x09\x0A\x0D\x20-\x7E\x80-\xFF]")
+WHITESPACE = re.compile(r"\s+")
+
+
+def detect_encoding(path):
+    detector = UniversalDetector()
+
+    with open(path, "rb") as f:
+        while not detector.done and f.tell() < DETECT_SAMPLE_BYTES:
+            block = f.read(16 * 1024)
+            if not block:
+                break
+            detector.feed(block)
+
+    detector.close()
+    encoding = detector.result.get("encoding")
+
+    # an ASCII sample says nothing about the rest, UTF-8 decodes both
+    if not encoding or encoding.lower() == "ascii":
+        return "utf-8"
+
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return "utf-8"
+
+    return encoding
+
+
+def normalize_blocks(blocks, strip_binary=True):
+    """
+    Collapses whitespace (and with `strip_binary` blanks out
+    non-printable characters) one block of text at a time, giving the
+    same result as on the joined text.
+    """
+
+    parts = []
+    space_before = True
+
+    for block in blocks:
+        if strip_binary:
+            block = NON_PRINTABLE.sub(" ", block)
+        block = WHITESPACE.sub(" ", block)
+
+        # a run of whitespace split across two blocks
+        if space_before and block.startswith(" "):
+            block = block[1:]
+
+        if block:
+            parts.append(block)
+            space_before = block.endswith(" ")
+
+    return "".join(parts).rstrip()
+
+
+def normalize_text(text, strip_binary=True):
+    return normalize_blocks([text], strip_binary)
+
+
+def read_blocks(path, encoding):
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+
+    with open(path, "rb") as f:
+        while True:
+            raw = f.read(READ_BLOCK_BYTES)
+            if not raw:
+                break
+            yield decoder.decode(raw)
+
+    yield decoder.decode(b"", final=True)
+
+
+def read_text(path, strip_binary=True):
+    """
+    Normalized text of a text-like file of any size: the charset is
+    detected on a sample and the file decoded and cleaned in blocks,
+    so neither step holds the raw bytes of the whole file.
+    """
+
+    return normalize_blocks(read_blocks(path, detect_encoding(path)), strip_binary)
+
+
+# =========================================================
+# PDF
+# =========================================================
+def _count_pypdf2(path):
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def _extract_pypdf2(path, first, last):
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(first, last)]
+
+
+def _count_pdfium(path):
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _extract_pdfium(path, first, last):
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(path)
+    try:
+        texts = []
+        for i in range(first, last):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
+
+
+# name: (page count, text of pages [first, last)), module-level
+# functions so worker processes can run them
+PDF_ENGINES = {
+    "pypdf2": (_count_pypdf2, _extract_pypdf2),
+    "pypdfium2": (_count_pdfium, _extract_pdfium),
+}
+
+
+def pdf_engine():
+    if PDF_ENGINE != "auto":
+        if PDF_ENGINE not in PDF_ENGINES:
+            raise ValueError(f"Unknown PDF engine: {PDF_ENGINE}")
+        return PDF_ENGINE
+
+    try:
+        import pypdfium2  # noqa: F401
+        return "pypdfium2"
+    except ImportError:
+        return "pypdf2"
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pdf_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            # spawned, forking a server process with model threads is unsafe
+            _pool = ProcessPoolExecutor(
+                PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BLOCK_BYTES), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def pdf_pages(path):
+    """
+    Text of every page of a PDF, yielded in order as soon as it is
+    extracted. Large documents are split into page ranges extracted
+    in parallel by a process pool; results are cached by document
+    hash and engine under PDF_CACHE_DIR.
+    """
+
+    engine = pdf_engine()
+    count_pages, extract = PDF_ENGINES[engine]
+
+    cache_path = os.path.join(PDF_CACHE_DIR, f"{file_digest(path)}-{engine}.json")
+    try:
+        with open(cache_path) as f:
+            pages = json.load(f)["pages"]
+        # marks it recently used
+        os.utime(cache_path)
+    except (FileNotFoundError, ValueError):
+        pass
+    else:
+        yield from pages
+        return
+
+    total = count_pages(path)
+    ranges = [
+        (first, min(first + PDF_PAGES_PER_TASK, total))
+        for first in range(0, total, PDF_PAGES_PER_TASK)
+    ]
+
+    if total < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        results = (extract(path, first, last) for first, last in ranges)
+    else:
+        results = _pdf_pool().map(extract, repeat(path), *zip(*ranges))
+
+    pages = []
+    for texts in results:
+        for text in texts:
+            pages.append(text)
+            yield text
+
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump({"pages": pages}, f)
+    os.replace(cache_path + ".tmp", cache_path)
+
+    evict_pdf_cache(keep=cache_path)
+
+
+def evict_pdf_cache(keep=None, max_bytes=None):
+    """Deletes the least recently used cached documents beyond `max_bytes`."""
+
+    max_bytes = PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    entries = []
+    for name in os.listdir(PDF_CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+
+        path = os.path.join(PDF_CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # evicted by another worker meanwhile
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    used = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if used <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        used -= size
@@ -0,0 +1,80 @@
+import base64
+import os
+
+import numpy as np
+
+from metrics import stage
+
+
+# sentences returned by /ask
+ANSWER_SENTENCES = int(os.environ.get("ANSWER_SENTENCES", "6"))
+
+# sentence vectors are unit length, stored as int8 (x127) in the chunk
+VECTOR_SCALE = 127
+
+
+def unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def pack_vectors(vectors):
+    """Unit-normalized int8 copy of `vectors` as base64, for chunk JSON."""
+
+    codes = np.round(unit_rows(vectors) * VECTOR_SCALE).astype("int8")
+    return base64.b64encode(codes.tobytes()).decode("ascii")
+
+
+def unpack_vectors(packed, count):
+    codes = np.frombuffer(base64.b64decode(packed), dtype="int8")
+    return codes.reshape(count, -1).astype("float32") / VECTOR_SCALE
+
+
+def rank_sentences(kb, chunk_ids, q_emb, split, k=ANSWER_SENTENCES):
+    """
+    The `k` sentences of the retrieved chunks closest to the question,
+    best first, as (score, chunk, sentence) tuples.
+
+    Only those chunks' sentences are scored, against vectors computed
+    at ingest. Chunks indexed before that are split with `split` and
+    their sentences encoded here, in one batch.
+    """
+
+    q = unit_rows(np.reshape(q_emb, (1, -1)))[0]
+
+    chunks = [kb.chunks[i] for i in chunk_ids]
+    candidates = []
+    legacy = []
+
+    with stage("sentence_ranking"):
+        for chunk in chunks:
+            sentences = chunk.get("sentences")
+            if sentences is None:
+                sentences = split(chunk["text"])
+
+            packed = chunk.get("sentence_vectors")
+            if packed is None:
+                legacy.append((chunk, sentences))
+                continue
+
+            scores = unpack_vectors(packed, len(sentences)) @ q
+            candidates += zip(scores.tolist(), [chunk] * len(sentences), sentences)
+
+    if legacy:
+        texts = [s for _, sentences in legacy for s in sentences]
+        scores = (unit_rows(kb.encode(texts)) @ q).tolist() if texts else []
+        pairs = [(chunk, s) for chunk, sentences in legacy for s in sentences]
+        candidates += [(score, chunk, s) for score, (chunk, s) in zip(scores, pairs)]
+
+    ranked = []
+    seen = set()
+    for score, chunk, sentence in sorted(candidates, key=lambda c: -c[0]):
+        if not sentence or sentence in seen:
+            continue
+        seen.add(sentence)
+        ranked.append((score, chunk, sentence))
+        if len(ranked) == k:
+            break
+
+    return ranked
@@ -1,99 +1,20 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
-
-MODEL_NAME = "google/gemma-2b-it"
-
-print("🔄 Loading Gemma Model...")
-
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    device_map="auto",
-    torch_dtype=torch.float16
+from generation_backends import (
+    build_prompt, configured_backend, material_schema, parse_structured, timed_generate
 )
 
-print("✅ Gemma Model Loaded Successfully!")
-
-
-def build_prompt(text_chunk, difficulty, mode):
-    """
-    Builds DIFFERENT prompts for worksheet vs assessment
-    and forces use of ONLY knowledge base content.
-    """
-
-    base = f"""
-You are an educational content generator.
-
-Use ONLY the information provided below.
-Do NOT add outside knowledge.
-
-CONTENT:
-{text_chunk}
-
-DIFFICULTY LEVEL: {difficulty}
-"""
-
-    if mode == "worksheet":
-        prompt = base + """
-
-TASK: Create a STUDENT WORKSHEET.
-
-Generate:
-
-1) 5 Multiple Choice Questions
-2) 3 Short Answer Questions
-3) 2 Long Answer Questions
-
-Finally provide:
-
-ANSWER KEY with clear explanations.
-
-Do not invent facts.
-Only use the provided content.
-"""
-
-    else:
-        prompt = base + """
-
-TASK: Create a FORMAL ASSESSMENT.
-
-Generate:
-
-SECTION A – MCQs
-- 10 Multiple Choice Questions
-
-SECTION B – Short Answer
-- 5 Short Answer Questions
-
-SECTION C – Long Answer
-- 3 Long Answer Questions
-
-Provide:
-
-- Clear marking scheme
-- Rubrics
-- Answer key
-
-STRICT RULE:
-Use ONLY information from the given content.
-"""
+# transformers unless GENERATION_BACKEND or MODEL_SERVER_URL say otherwise
+backend = configured_backend("transformers")
 
-    return prompt
+CONTEXT_SIZE = backend.context_size
+MAX_NEW_TOKENS = backend.max_new_tokens
+STRUCTURED_MAX_NEW_TOKENS = backend.structured_max_new_tokens
 
 
-def generate_with_gemma(prompt):
+def count_tokens(texts):
 
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    return backend.count_tokens(texts)
 
-    outputs = model.generate(
-        **inputs,
-        max_new_tokens=700,
-        temperature=0.6,
-        top_p=0.9,
-        do_sample=True
-    )
 
-    result = tokenizer.decode(outputs[0], skip_special_tokens=True)
+def generate_with_gemma(prompt, max_new_tokens=None, schema=None):
 
-    return result
+    return timed_generate(backend, prompt, max_new_tokens, schema)
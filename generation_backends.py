@@ -0,0 +1,699 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import (
+    GENERATION_TOKENS_PER_SECOND, MODEL_LOAD_SECONDS, SPECULATIVE_ACCEPTANCE, stage
+)
+from model_client import MODEL_SERVER_URL, ModelClient
+
+
+# "transformers" (Hugging Face, fp16), "transformers_cpu" (the same
+# model tuned for CPU-only machines), "llama_cpp" (GGUF Q4_K_M) or
+# "stub" (no model, for offline tests and benchmarks); overrides the
+# default of whichever service module is imported
+GENERATION_BACKEND = os.environ.get("GENERATION_BACKEND")
+
+MAX_NEW_TOKENS = 700
+
+# speculative decoding: "lookup" drafts tokens by matching the prompt
+# (generated worksheets copy a lot from CONTENT), "draft" runs the
+# DRAFT_MODEL (transformers only, must share Gemma's tokenizer); unset
+# decodes one token per forward pass
+SPECULATIVE_DECODING = os.environ.get("SPECULATIVE_DECODING", "")
+SPECULATIVE_TOKENS = int(os.environ.get("SPECULATIVE_TOKENS", "10"))
+DRAFT_MODEL = os.environ.get("DRAFT_MODEL")
+
+# GENERATION_BACKEND=transformers_cpu: weights in "bf16", "fp32" or
+# "int8" (fp32 with dynamically quantized Linear layers), torch threads
+# (one per core by default), a KV cache allocated once at its full
+# length instead of grown every token, and torch.compile
+CPU_DTYPES = ("bf16", "fp32", "int8")
+CPU_DTYPE = os.environ.get("CPU_DTYPE", "bf16")
+CPU_THREADS = int(os.environ.get("CPU_THREADS", str(os.cpu_count() or 1)))
+CPU_STATIC_CACHE = os.environ.get("CPU_STATIC_CACHE", "1").lower() in ("1", "true", "yes")
+CPU_COMPILE = os.environ.get("CPU_COMPILE", "").lower() in ("1", "true", "yes")
+
+# structured worksheets and assessments; every field is required so the
+# grammar never has to decide whether to emit one, "options" is empty
+# for non-MCQ questions
+QUESTION_TYPES = ["mcq", "short_answer", "long_answer"]
+
+# questions in each section, as build_prompt asks for them
+SECTION_QUESTIONS = {"worksheet": (5, 3, 2), "assessment": (10, 5, 3)}
+
+# a full assessment as JSON, options and explanations included, runs to
+# well over MAX_NEW_TOKENS; cut off, it doesn't parse
+STRUCTURED_MAX_NEW_TOKENS = int(os.environ.get("STRUCTURED_MAX_NEW_TOKENS", "2048"))
+
+# llama.cpp allocates the KV cache for its whole context window up
+# front; 4096 fits a full structured assessment next to its content
+LLAMA_CONTEXT_SIZE = int(os.environ.get("LLAMA_CONTEXT_SIZE", "2048"))
+
+
+def material_schema(mode):
+    """
+    JSON schema of a structured worksheet or assessment. The grammar
+    bounds the sections and questions to the counts in the prompt, so
+    the model can't run on past them.
+    """
+
+    counts = SECTION_QUESTIONS["worksheet" if mode == "worksheet" else "assessment"]
+
+    return {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string"},
+            "sections": {
+                "type": "array",
+                "minItems": len(counts),
+                "maxItems": len(counts),
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "title": {"type": "string"},
+                        "questions": {
+                            "type": "array",
+                            "minItems": min(counts),
+                            "maxItems": max(counts),
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "type": {"type": "string", "enum": QUESTION_TYPES},
+                                    "question": {"type": "string"},
+                                    "options": {"type": "array", "maxItems": 4, "items": {"type": "string"}},
+                                    "answer": {"type": "string"},
+                                    "explanation": {"type": "string"},
+                                    "marks": {"type": "integer"}
+                                },
+                                "required": ["type", "question", "options", "answer", "explanation", "marks"]
+                            }
+                        }
+                    },
+                    "required": ["title", "questions"]
+                }
+            }
+        },
+        "required": ["title", "sections"]
+    }
+
+
+STRUCTURED_INSTRUCTIONS = """
+OUTPUT FORMAT:
+Return only JSON: a "title" and a list of "sections", each with a
+"title" and "questions". Every question has a "type" (mcq,
+short_answer or long_answer), the "question", "options" (four for mcq,
+otherwise empty), the "answer", an "explanation" and "marks".
+"""
+
+
+def build_prompt(text_chunk, difficulty, mode, structured=False):
+    """
+    Builds DIFFERENT prompts for worksheet vs assessment
+    and forces use of ONLY knowledge base content.
+    With `structured` the answer must follow material_schema(mode).
+    """
+
+    base = f"""
+You are an educational content generator.
+
+Use ONLY the information provided below.
+Do NOT add outside knowledge.
+
+CONTENT:
+{text_chunk}
+
+DIFFICULTY LEVEL: {difficulty}
+"""
+
+    if mode == "worksheet":
+        prompt = base + """
+
+TASK: Create a STUDENT WORKSHEET.
+
+Generate:
+
+1) 5 Multiple Choice Questions
+2) 3 Short Answer Questions
+3) 2 Long Answer Questions
+
+Finally provide:
+
+ANSWER KEY with clear explanations.
+
+Do not invent facts.
+Only use the provided content.
+"""
+
+    else:
+        prompt = base + """
+
+TASK: Create a FORMAL ASSESSMENT.
+
+Generate:
+
+SECTION A – MCQs
+- 10 Multiple Choice Questions
+
+SECTION B – Short Answer
+- 5 Short Answer Questions
+
+SECTION C – Long Answer
+- 3 Long Answer Questions
+
+Provide:
+
+- Clear marking scheme
+- Rubrics
+- Answer key
+
+STRICT RULE:
+Use ONLY information from the given content.
+"""
+
+    if structured:
+        prompt += STRUCTURED_INSTRUCTIONS
+
+    return prompt
+
+
+def parse_structured(text):
+    """The material dict of a structured generation, None if it was cut off."""
+
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+# =========================================================
+# BACKEND INTERFACE
+# =========================================================
+class GenerationBackend:
+    """
+    A way of running Gemma. Implementations load their model in
+    load() and report generation statistics from generate_with_stats(),
+    which returns a dict with the generated "text" plus
+    "prompt_tokens" and "new_tokens". Backends that count them add
+    "decode_passes" (forward passes of the model) and "draft_tokens"
+    (tokens proposed by speculative decoding).
+    """
+
+    name = None
+    weights = None
+    # room for a structured answer next to the content
+    context_size = 4096
+    max_new_tokens = MAX_NEW_TOKENS
+    structured_max_new_tokens = STRUCTURED_MAX_NEW_TOKENS
+
+    def __init__(self):
+        self.load_seconds = None
+        self.speculative = SPECULATIVE_DECODING
+        # per-thread pass and draft counters of the running generation
+        self.counts = threading.local()
+
+    def _reset_counts(self):
+        self.counts.passes = 0
+        self.counts.draft = 0
+
+    def load(self):
+        raise NotImplementedError
+
+    def count_tokens(self, texts):
+        raise NotImplementedError
+
+    def generate_with_stats(self, prompt, max_new_tokens=None):
+        raise NotImplementedError
+
+    def generate_structured(self, prompt, schema, max_new_tokens=None):
+        """
+        Like generate_with_stats, but decoding is constrained so "text"
+        is JSON following `schema`, and it stops once the JSON is complete.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompt, max_new_tokens=None):
+        return self.generate_with_stats(prompt, max_new_tokens)["text"]
+
+    def generate_batch(self, prompts, max_new_tokens=None):
+        return [self.generate(p, max_new_tokens) for p in prompts]
+
+
+class TransformersBackend(GenerationBackend):
+
+    name = "transformers"
+    weights = "fp16"
+    model_name = "google/gemma-2b-it"
+    context_size = 8192
+
+    def load(self):
+        from transformers import AutoTokenizer
+
+        print("🔄 Loading Gemma Model...")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+
+        self.model = self._from_pretrained(self.model_name)
+        self.model.register_forward_hook(self._count_pass)
+
+        self.draft_model = None
+        if self.speculative == "draft":
+            if not DRAFT_MODEL:
+                raise ValueError("SPECULATIVE_DECODING=draft needs DRAFT_MODEL")
+
+            self.draft_model = self._from_pretrained(DRAFT_MODEL)
+            # the draft model proposes one token per forward pass
+            self.draft_model.register_forward_hook(self._count_draft)
+
+        print("✅ Gemma Model Loaded Successfully!")
+
+    def _from_pretrained(self, model_name):
+        from transformers import AutoModelForCausalLM
+        import torch
+
+        return AutoModelForCausalLM.from_pretrained(
+            model_name,
+            device_map="auto",
+            torch_dtype=torch.float16
+        )
+
+    def _count_pass(self, module, args, output):
+        self.counts.passes = getattr(self.counts, "passes", 0) + 1
+
+    def _count_draft(self, module, args, output):
+        self.counts.draft = getattr(self.counts, "draft", 0) + 1
+
+    def _speculative_kwargs(self):
+        if self.speculative == "lookup":
+            return {"prompt_lookup_num_tokens": SPECULATIVE_TOKENS}
+        if self.speculative == "draft":
+            return {"assistant_model": self.draft_model}
+        return {}
+
+    def count_tokens(self, texts):
+        encoded = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _generate(self, inputs, max_new_tokens, **kwargs):
+        self._reset_counts()
+
+        return self.model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens or self.max_new_tokens,
+            temperature=0.6,
+            top_p=0.9,
+            do_sample=True,
+            **kwargs
+        )
+
+    def _generate_one(self, prompt, max_new_tokens, **kwargs):
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        outputs = self._generate(inputs, max_new_tokens, **kwargs)
+
+        prompt_tokens = inputs["input_ids"].shape[1]
+
+        return {
+            # generate() returns prompt + continuation, decode only the new tokens
+            "text": self.tokenizer.decode(outputs[0][prompt_tokens:], skip_special_tokens=True),
+            "prompt_tokens": prompt_tokens,
+            "new_tokens": outputs.shape[1] - prompt_tokens,
+            "decode_passes": self.counts.passes,
+            # prompt lookup proposals aren't observable from outside generate()
+            "draft_tokens": self.counts.draft if self.speculative == "draft" else None
+        }
+
+    def generate_with_stats(self, prompt, max_new_tokens=None):
+        return self._generate_one(prompt, max_new_tokens, **self._speculative_kwargs())
+
+    def generate_structured(self, prompt, schema, max_new_tokens=None):
+        # optional dependency, only needed for structured output
+        from lmformatenforcer import JsonSchemaParser
+        from lmformatenforcer.integrations.transformers import (
+            build_transformers_prefix_allowed_tokens_fn
+        )
+
+        # turned into a logits processor that masks tokens breaking the schema
+        allowed_tokens = build_transformers_prefix_allowed_tokens_fn(
+            self.tokenizer, JsonSchemaParser(schema)
+        )
+
+        return self._generate_one(prompt, max_new_tokens, prefix_allowed_tokens_fn=allowed_tokens)
+
+    def generate_batch(self, prompts, max_new_tokens=None):
+        # decoder-only models continue from the right, so pad on the left;
+        # assisted generation only supports one sequence, batches decode normally
+        self.tokenizer.padding_side = "left"
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        outputs = self._generate(inputs, max_new_tokens)
+
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return [self.tokenizer.decode(o, skip_special_tokens=True) for o in new_tokens]
+
+
+class TransformersCPUBackend(TransformersBackend):
+    """
+    The transformers backend tuned for machines without a GPU, where
+    fp16 matmuls are slow or upcast: CPU_DTYPE weights, CPU_THREADS
+    torch threads, a static KV cache and optionally torch.compile.
+    """
+
+    name = "transformers_cpu"
+
+    def __init__(self):
+        super().__init__()
+        self.static_cache = False
+        self.cache_lock = threading.Lock()
+
+    def load(self):
+        if CPU_DTYPE not in CPU_DTYPES:
+            raise ValueError(f"Unknown CPU_DTYPE: {CPU_DTYPE}")
+        self.weights = CPU_DTYPE
+
+        import torch
+
+        torch.set_num_threads(CPU_THREADS)
+
+        super().load()
+
+        # assisted generation grows its cache as drafts are accepted
+        self.static_cache = CPU_STATIC_CACHE and not self.speculative
+        if self.static_cache:
+            self.model.generation_config.cache_implementation = "static"
+
+        if CPU_COMPILE:
+            # a static cache keeps shapes fixed, so decode steps reuse the graph
+            self.model.forward = torch.compile(self.model.forward)
+
+    def _from_pretrained(self, model_name):
+        from transformers import AutoModelForCausalLM
+        import torch
+
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.bfloat16 if CPU_DTYPE == "bf16" else torch.float32,
+            low_cpu_mem_usage=True
+        )
+
+        if CPU_DTYPE == "int8":
+            # int8 Linear weights, activations quantized on the fly
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        return model.eval()
+
+    def _generate(self, inputs, max_new_tokens, **kwargs):
+        if not self.static_cache:
+            return super()._generate(inputs, max_new_tokens, **kwargs)
+
+        # the static cache is one buffer on the model, shared by every call
+        with self.cache_lock:
+            return super()._generate(inputs, max_new_tokens, **kwargs)
+
+
+class LlamaCppBackend(GenerationBackend):
+
+    name = "llama_cpp"
+    weights = "gguf"
+    model_path = os.environ.get("GGUF_MODEL_PATH", "model/gemma-2b-it-q4_k_m.gguf")
+    context_size = LLAMA_CONTEXT_SIZE
+    # half the window at most, so structured prompts keep room for content
+    structured_max_new_tokens = min(STRUCTURED_MAX_NEW_TOKENS, LLAMA_CONTEXT_SIZE // 2)
+    n_threads = 4
+
+    def load(self):
+        from llama_cpp import Llama
+
+        self.llm = None
+        self.grammars = {}
+
+        if os.path.exists(self.model_path):
+            print(f"Loading LLM from {self.model_path}...")
+
+            try:
+                kwargs = {}
+                if self.speculative:
+                    # llama-cpp-python only ships prompt lookup drafting
+                    kwargs["draft_model"] = self._lookup_drafter()
+
+                self.llm = Llama(
+                    model_path=self.model_path,
+                    n_ctx=self.context_size,
+                    n_threads=self.n_threads,
+                    **kwargs
+                )
+                self._count_passes()
+
+                print("LLM loaded successfully.")
+
+            except Exception as e:
+                print(f"Failed to load LLM: {e}")
+
+        else:
+            print(f"Warning: LLM model not found at {self.model_path}. Using mock response.")
+
+    def _lookup_drafter(self):
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        counts = self.counts
+
+        class CountingLookup(LlamaPromptLookupDecoding):
+
+            def __call__(self, input_ids, *args, **kwargs):
+                draft = super().__call__(input_ids, *args, **kwargs)
+                counts.draft = getattr(counts, "draft", 0) + len(draft)
+                return draft
+
+        return CountingLookup(num_pred_tokens=SPECULATIVE_TOKENS)
+
+    def _count_passes(self):
+        # every eval() is one forward pass over the new (and drafted) tokens
+        eval_batch = self.llm.eval
+
+        def counting_eval(tokens):
+            self.counts.passes = getattr(self.counts, "passes", 0) + 1
+            return eval_batch(tokens)
+
+        self.llm.eval = counting_eval
+
+    def count_tokens(self, texts):
+        if not self.llm:
+            # rough estimate so packing still works without the model
+            return [len(t) // 4 + 1 for t in texts]
+
+        return [len(self.llm.tokenize(t.encode("utf-8"), add_bos=False)) for t in texts]
+
+    def generate_with_stats(self, prompt, max_new_tokens=None):
+        return self._complete(prompt, max_new_tokens, stop=["<end_of_turn>", "User:", "System:"])
+
+    def generate_structured(self, prompt, schema, max_new_tokens=None):
+        from llama_cpp import LlamaGrammar
+
+        # GBNF grammar compiled from the schema, once per schema
+        key = json.dumps(schema, sort_keys=True)
+        if key not in self.grammars:
+            self.grammars[key] = LlamaGrammar.from_json_schema(key, verbose=False)
+
+        # "User:" may well appear inside a JSON string, the grammar ends generation
+        return self._complete(prompt, max_new_tokens, stop=["<end_of_turn>"], grammar=self.grammars[key])
+
+    def _complete(self, prompt, max_new_tokens, **kwargs):
+        if not self.llm:
+            return {
+                "text": f"[MODEL NOT LOADED] Missing model at: {self.model_path}",
+                "prompt_tokens": 0,
+                "new_tokens": 0
+            }
+
+        try:
+            self._reset_counts()
+
+            output = self.llm(
+                f"<start_of_turn>user\n{prompt}<end_of_turn>\n<start_of_turn>model\n",
+                max_tokens=max_new_tokens or self.max_new_tokens,
+                echo=False,
+                **kwargs
+            )
+
+            return {
+                "text": output["choices"][0]["text"].strip(),
+                "prompt_tokens": output["usage"]["prompt_tokens"],
+                "new_tokens": output["usage"]["completion_tokens"],
+                "decode_passes": self.counts.passes,
+                "draft_tokens": self.counts.draft if self.speculative else None
+            }
+
+        except Exception as e:
+            print(f"Generation error: {e}")
+            return {"text": f"Generation failed: {str(e)}", "prompt_tokens": 0, "new_tokens": 0}
+
+
+class RemoteBackend(GenerationBackend):
+    """Whatever backend the shared model server (model_server.py) runs."""
+
+    name = "remote"
+
+    def load(self):
+        self.client = ModelClient(MODEL_SERVER_URL)
+
+        info = self.client.info()
+        self.context_size = info["context_size"]
+        self.max_new_tokens = info["max_new_tokens"]
+        self.structured_max_new_tokens = info["structured_max_new_tokens"]
+
+    def count_tokens(self, texts):
+        return self.client.count_tokens(texts)
+
+    def generate(self, prompt, max_new_tokens=None, schema=None):
+        return self.client.generate(
+            prompt, max_tokens=max_new_tokens or self.max_new_tokens, schema=schema
+        )
+
+    def generate_with_stats(self, prompt, max_new_tokens=None, schema=None):
+        text = self.generate(prompt, max_new_tokens, schema)
+        prompt_tokens, new_tokens = self.count_tokens([prompt, text])
+
+        return {"text": text, "prompt_tokens": prompt_tokens, "new_tokens": new_tokens}
+
+    def generate_structured(self, prompt, schema, max_new_tokens=None):
+        return self.generate_with_stats(prompt, max_new_tokens or self.structured_max_new_tokens, schema)
+
+    def generate_batch(self, prompts, max_new_tokens=None):
+        if not prompts:
+            return []
+
+        # sent concurrently so the model server batches them together
+        with ThreadPoolExecutor(len(prompts)) as pool:
+            return list(pool.map(lambda p: self.generate(p, max_new_tokens), prompts))
+
+
+class StubBackend(GenerationBackend):
+    """
+    Model-free stand-in for offline tests and benchmarks: "generates"
+    the first words of the CONTENT block. Tokens are whitespace words.
+    """
+
+    name = "stub"
+
+    def load(self):
+        pass
+
+    def count_tokens(self, texts):
+        return [len(t.split()) for t in texts]
+
+    def generate_with_stats(self, prompt, max_new_tokens=None):
+        content = prompt.split("CONTENT:", 1)[-1].split("DIFFICULTY LEVEL:", 1)[0]
+        words = content.split()[:max_new_tokens or self.max_new_tokens]
+
+        return {
+            "text": " ".join(words),
+            "prompt_tokens": len(prompt.split()),
+            "new_tokens": len(words)
+        }
+
+    def generate_structured(self, prompt, schema, max_new_tokens=None):
+        # one short-answer question per CONTENT sentence, whatever the schema
+        content = prompt.split("CONTENT:", 1)[-1].split("DIFFICULTY LEVEL:", 1)[0]
+        sentences = [s.strip() for s in content.split(".") if s.strip()][:10]
+
+        material = {
+            "title": "Worksheet",
+            "sections": [{
+                "title": "Short Answer",
+                "questions": [{
+                    "type": "short_answer",
+                    "question": f"Explain: {s}?",
+                    "options": [],
+                    "answer": s,
+                    "explanation": s,
+                    "marks": 2
+                } for s in sentences]
+            }]
+        }
+        text = json.dumps(material)
+
+        return {"text": text, "prompt_tokens": len(prompt.split()), "new_tokens": len(text.split())}
+
+
+BACKENDS = {
+    "transformers": TransformersBackend,
+    "transformers_cpu": TransformersCPUBackend,
+    "llama_cpp": LlamaCppBackend,
+    "remote": RemoteBackend,
+    "stub": StubBackend,
+}
+
+_loaded = {}
+
+
+def get_backend(name):
+    """Returns the loaded backend `name`, loading it on first use."""
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown generation backend: {name}")
+
+    if name not in _loaded:
+        backend = BACKENDS[name]()
+
+        start = time.perf_counter()
+        backend.load()
+        backend.load_seconds = time.perf_counter() - start
+        MODEL_LOAD_SECONDS.set(backend.load_seconds, f"generation:{name}")
+
+        _loaded[name] = backend
+
+    return _loaded[name]
+
+
+def accepted_tokens(result):
+    """
+    Drafted tokens the model accepted in a generate_with_stats result:
+    every forward pass yields one token of its own, the rest were
+    accepted drafts. None when the backend doesn't count passes.
+    """
+
+    if result.get("decode_passes") is None:
+        return None
+    return max(result["new_tokens"] - result["decode_passes"], 0)
+
+
+def timed_generate(backend, prompt, max_new_tokens=None, schema=None):
+    """
+    Generates with `backend`, constrained to JSON `schema` if given,
+    recording the time taken, tokens/s and the speculative decoding
+    acceptance rate.
+    """
+
+    with stage("generate"):
+        start = time.perf_counter()
+        if schema is None:
+            result = backend.generate_with_stats(prompt, max_new_tokens)
+        else:
+            result = backend.generate_structured(
+                prompt, schema, max_new_tokens or backend.structured_max_new_tokens
+            )
+        elapsed = time.perf_counter() - start
+
+    if result["new_tokens"]:
+        GENERATION_TOKENS_PER_SECOND.observe(result["new_tokens"] / elapsed, backend.name)
+
+    if result.get("draft_tokens"):
+        SPECULATIVE_ACCEPTANCE.observe(
+            accepted_tokens(result) / result["draft_tokens"], backend.name
+        )
+
+    return result["text"]
+
+
+def configured_backend(default):
+    """
+    The backend this process should use: the shared model server when
+    MODEL_SERVER_URL is set, else GENERATION_BACKEND, else `default`.
+    """
+
+    if MODEL_SERVER_URL:
+        return get_backend("remote")
+
+    return get_backend(GENERATION_BACKEND or default)
@@ -0,0 +1,251 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from generation_backends import material_schema, parse_structured, timed_generate
+from metrics import stage
+
+
+# jobs only run once no interactive generation happened for this long
+JOBS_IDLE_SECONDS = float(os.environ.get("JOBS_IDLE_SECONDS", "5"))
+
+# specs generated together; bounds how long an interactive request
+# arriving mid-batch waits
+JOBS_BATCH_SIZE = int(os.environ.get("JOBS_BATCH_SIZE", "4"))
+
+POLL_SECONDS = 1
+
+MODES = ("worksheet", "assessment")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    Batch generation jobs, run in the background while the server is
+    idle.
+
+    A job is a list of specs (mode, difficulty, topic, structured).
+    Jobs and their results are JSON files in `folder`, so every worker
+    can serve them, and a worker claims a job with an exclusive claim
+    file before running it. `prepare(spec)` builds the prompt of a
+    spec; plain specs are generated JOBS_BATCH_SIZE at a time with
+    the backend's batched generation.
+    """
+
+    def __init__(self, folder, backend, prepare):
+        self.folder = folder
+        self.backend = backend
+        self.prepare = prepare
+
+        self.lock = threading.Lock()
+        self.batch_done = threading.Condition(self.lock)
+        self.active = 0
+        self.last_interactive = 0.0
+        self.batch_running = False
+        self.wakeup = threading.Event()
+
+        os.makedirs(folder, exist_ok=True)
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _path(self, job_id, ext="json"):
+        return os.path.join(self.folder, f"{job_id}.{ext}")
+
+    # -------------------------------------------------
+    # STORAGE
+    # -------------------------------------------------
+    def _save(self, job):
+        tmp = self._path(job["job_id"], "json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["job_id"]))
+
+    def get(self, job_id):
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self):
+        jobs = []
+        for name in sorted(os.listdir(self.folder)):
+            if name.endswith(".json"):
+                job = self.get(name[:-len(".json")])
+                if job:
+                    jobs.append({k: job[k] for k in ("job_id", "status", "created", "finished")})
+        return jobs
+
+    def submit(self, specs):
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "created": time.time(),
+            "finished": None,
+            "results": [{"spec": spec, "status": "queued"} for spec in specs]
+        }
+        self._save(job)
+        self.wakeup.set()
+
+        return job
+
+    def _claim(self, job_id):
+        path = self._path(job_id, "claim")
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # taken over from a worker that died mid-job
+            with open(path) as f:
+                owner = f.read().strip()
+            if owner.isdigit() and _pid_alive(int(owner)):
+                return False
+            os.remove(path)
+            return self._claim(job_id)
+
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def _next_job(self):
+        names = [n for n in os.listdir(self.folder) if n.endswith(".json")]
+        jobs = [job for job in (self.get(n[:-len(".json")]) for n in names) if job]
+
+        for job in sorted(jobs, key=lambda j: j["created"]):
+            if job["status"] == "done" or not self._claim(job["job_id"]):
+                continue
+
+            # another worker may have finished it since it was read
+            job = self.get(job["job_id"])
+            if job["status"] != "done":
+                return job
+            os.remove(self._path(job["job_id"], "claim"))
+
+        return None
+
+    # -------------------------------------------------
+    # SCHEDULING
+    # -------------------------------------------------
+    @contextmanager
+    def interactive(self):
+        """
+        Wrap interactive generation so jobs give way to it. A batch
+        already generating finishes first, the backend never runs one
+        alongside an interactive generation.
+        """
+
+        with self.lock:
+            self.active += 1
+            self.batch_done.wait_for(lambda: not self.batch_running)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.last_interactive = time.monotonic()
+
+    def _idle_locked(self):
+        return self.active == 0 and time.monotonic() - self.last_interactive >= JOBS_IDLE_SECONDS
+
+    def _idle(self):
+        with self.lock:
+            return self._idle_locked()
+
+    def _wait_idle(self):
+        while not self._idle():
+            time.sleep(POLL_SECONDS)
+
+    @contextmanager
+    def _batch(self):
+        """Held while a batch generates, taken only when the server is idle."""
+
+        with self.lock:
+            while not self._idle_locked():
+                self.batch_done.wait(POLL_SECONDS)
+            self.batch_running = True
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.batch_running = False
+                self.batch_done.notify_all()
+
+    def _loop(self):
+        while True:
+            self.wakeup.wait(POLL_SECONDS * 10)
+            self.wakeup.clear()
+
+            self._wait_idle()
+
+            job = self._next_job()
+            while job:
+                self._run(job)
+                job = self._next_job()
+
+    def _run(self, job):
+        job["status"] = "running"
+        self._save(job)
+
+        pending = [i for i, r in enumerate(job["results"]) if r["status"] == "queued"]
+
+        for start in range(0, len(pending), JOBS_BATCH_SIZE):
+            with self._batch():
+                self._generate(job["results"], pending[start:start + JOBS_BATCH_SIZE])
+            self._save(job)
+
+        job["status"] = "done"
+        job["finished"] = time.time()
+        self._save(job)
+
+        os.remove(self._path(job["job_id"], "claim"))
+
+    def _generate(self, results, positions):
+        prompts = {}
+        for i in positions:
+            try:
+                prompts[i] = self.prepare(results[i]["spec"])
+            except Exception as e:
+                results[i].update(status="error", error=str(getattr(e, "detail", e)))
+
+        plain = [i for i in prompts if not results[i]["spec"].get("structured")]
+        structured = [i for i in prompts if results[i]["spec"].get("structured")]
+
+        if plain:
+            try:
+                with stage("job_batch"):
+                    texts = self.backend.generate_batch([prompts[i] for i in plain])
+                for i, text in zip(plain, texts):
+                    results[i].update(status="done", output=text)
+            except Exception as e:
+                for i in plain:
+                    results[i].update(status="error", error=str(e))
+
+        # a grammar constrains one sequence at a time
+        for i in structured:
+            try:
+                material = parse_structured(
+                    timed_generate(
+                        self.backend, prompts[i], schema=material_schema(results[i]["spec"]["mode"])
+                    )
+                )
+                if material is None:
+                    results[i].update(status="error", error="Generation stopped before the JSON was complete")
+                else:
+                    results[i].update(status="done", output=material)
+            except Exception as e:
+                results[i].update(status="error", error=str(e))
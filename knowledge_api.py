@@ -0,0 +1,520 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from typing import List, Optional
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from pydantic import BaseModel
+
+from answer_cache import answer_with_cache
+from bulk_ingest import INGEST_WORKERS, BulkEmbedder, BulkIngests
+from context_packing import context_budget, select_context
+from crawler import crawl
+from generation_backends import build_prompt, material_schema, parse_structured
+from generation_jobs import MODES, JobQueue
+from metrics import stage, timed
+from model_client import MODEL_SERVER_URL
+from namespaces import DEFAULT_NAMESPACE, Namespaces, merge, selected_namespaces
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process lock on Windows, run a single worker there
+    fcntl = None
+
+
+MAX_BATCH_QUESTIONS = 256
+MAX_JOB_SPECS = 100
+
+
+# reads use `namespace`, or merge the top-k of all `namespaces`
+class QuestionRequest(BaseModel):
+    question: str
+    namespace: Optional[str] = None
+    namespaces: Optional[List[str]] = None
+
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+    namespace: Optional[str] = None
+    namespaces: Optional[List[str]] = None
+
+
+class URLRequest(BaseModel):
+    url: str
+    namespace: Optional[str] = None
+    # follow same-site links this many levels deep (at most 3)
+    depth: int = 0
+
+
+class StorageRequest(BaseModel):
+    storage: str
+    namespace: Optional[str] = None
+
+
+class GenerateRequest(BaseModel):
+    difficulty: str
+    topic: Optional[str] = None
+    # JSON sections/questions/answer key instead of free text
+    structured: bool = False
+    namespace: Optional[str] = None
+    namespaces: Optional[List[str]] = None
+
+
+class JobSpec(BaseModel):
+    mode: str
+    difficulty: str
+    topic: Optional[str] = None
+    structured: bool = False
+    namespace: Optional[str] = None
+    namespaces: Optional[List[str]] = None
+
+
+class JobRequest(BaseModel):
+    specs: List[JobSpec]
+
+
+@timed("save_json")
+def save_json(folder, data):
+    # readers never see a half written file
+    path = f"{folder}/knowledge.json"
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+@timed("load_json")
+def load_json(folder):
+    path = f"{folder}/knowledge.json"
+    if os.path.exists(path):
+        return json.load(open(path))
+    return []
+
+
+_record_locks = {}
+_record_locks_guard = threading.Lock()
+
+
+@contextmanager
+def editing_records(folder):
+    """
+    Yields the records in knowledge.json and saves them on exit, one
+    writer at a time across threads and worker processes.
+    """
+    with _record_locks_guard:
+        lock = _record_locks.setdefault(folder, threading.Lock())
+
+    with ExitStack() as locks:
+        locks.enter_context(lock)
+        lock_file = locks.enter_context(open(f"{folder}/knowledge.lock", "w"))
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        data = load_json(folder)
+        yield data
+        save_json(folder, data)
+
+
+def website_record(page):
+    return {
+        "source_id": str(uuid.uuid4()),
+        "source_type": "website",
+        "source_path": page["url"],
+        "content": page["content"]
+    }
+
+
+@timed("scrape")
+def scrape_website(url):
+    return website_record(crawl(url)[0])
+
+
+def find_source(data, source_id):
+    for i, rec in enumerate(data):
+        if rec["source_id"] == source_id:
+            return i
+
+    raise HTTPException(status_code=404, detail="Source not found")
+
+
+class KnowledgeAPI:
+    """
+    The knowledge base, question answering and generation routes both
+    AI servers serve, on `router`. Each server passes what it does its
+    own way: `load_file(path)` extracts a record, `create_chunks(records)`
+    splits records into chunks, `format_answer(chunk_ids, kb, embedding)`
+    writes an answer and `generate(prompt, schema=None)` runs `backend`.
+    """
+
+    def __init__(self, embed_model, backend, generate, load_file, create_chunks, format_answer,
+                 data_folder="data", upload_folder="uploads"):
+        self.embed_model = embed_model
+        self.backend = backend
+        self.generate = generate
+        self.load_file = load_file
+        self.create_chunks = create_chunks
+        self.format_answer = format_answer
+        self.upload_folder = upload_folder
+
+        os.makedirs(upload_folder, exist_ok=True)
+        os.makedirs(data_folder, exist_ok=True)
+
+        # a knowledge base per teacher, class or subject
+        self.namespaces = Namespaces(data_folder, embed_model)
+        self.ingests = BulkIngests(os.path.join(data_folder, "ingests"))
+        self.jobs = JobQueue(os.path.join(data_folder, "jobs"), backend, self.job_prompt)
+
+        self.router = APIRouter()
+        for method, path, endpoint in [
+            ("POST", "/upload", self.upload_document),
+            ("POST", "/upload/bulk", self.upload_bulk),
+            ("GET", "/upload/bulk/{ingest_id}", self.bulk_ingest_progress),
+            ("GET", "/namespaces", self.list_namespaces),
+            ("GET", "/sources", self.list_sources),
+            ("DELETE", "/sources/{source_id}", self.delete_source),
+            ("PUT", "/sources/{source_id}", self.replace_source),
+            ("POST", "/scrape", self.scrape),
+            ("POST", "/ask", self.ask),
+            ("POST", "/ask/batch", self.ask_batch),
+            ("GET", "/cache/stats", self.cache_stats),
+            ("POST", "/knowledge/storage", self.set_vector_storage),
+            ("POST", "/generate/worksheet", self.worksheet),
+            ("POST", "/generate/assessment", self.assessment),
+            ("POST", "/jobs", self.create_job),
+            ("GET", "/jobs", self.list_jobs),
+            ("GET", "/jobs/{job_id}", self.get_job),
+        ]:
+            self.router.add_api_route(path, endpoint, methods=[method])
+
+    # -------------------------------------------------
+    # NAMESPACES
+    # -------------------------------------------------
+    def namespace_kb(self, name, create=False):
+        try:
+            return self.namespaces.get(name, create)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown namespace: {name}")
+
+    def list_namespaces(self):
+        return {"namespaces": [
+            {"namespace": name, "chunks": len(self.namespace_kb(name))}
+            for name in self.namespaces.names()
+        ]}
+
+    def ensure_indexed(self, names):
+        kbs = [self.namespace_kb(name) for name in names]
+
+        for kb in kbs:
+            # pick up generations published by other workers
+            kb.refresh()
+
+            if not kb.chunks:
+                data = load_json(kb.folder)
+
+                # knowledge.json written before the indexes were persisted
+                if data:
+                    kb.rebuild(self.create_chunks(data))
+
+        if not any(len(kb) for kb in kbs):
+            raise HTTPException(status_code=400, detail="No knowledge available")
+
+        return merge(kbs)
+
+    # -------------------------------------------------
+    # UPLOAD
+    # -------------------------------------------------
+    def save_upload(self, file):
+        path = os.path.join(self.upload_folder, file.filename)
+
+        with open(path, "wb") as f:
+            f.write(file.file.read())
+
+        return path
+
+    def add_record(self, rec, namespace):
+        kb = self.namespace_kb(namespace or DEFAULT_NAMESPACE, create=True)
+
+        with editing_records(kb.folder) as data:
+            data.append(rec)
+
+        kb.add_chunks(self.create_chunks([rec]))
+
+    def upload_document(self, file: UploadFile = File(...), namespace: Optional[str] = None):
+        rec = self.load_file(self.save_upload(file))
+
+        self.add_record(rec, namespace)
+
+        return {"message": "File added to knowledge base", "source_id": rec["source_id"]}
+
+    def save_records(self, kb, records):
+        with editing_records(kb.folder) as data:
+            data += records
+
+    def upload_bulk(self, files: List[UploadFile] = File(...), namespace: Optional[str] = None):
+        kb = self.namespace_kb(namespace or DEFAULT_NAMESPACE, create=True)
+
+        paths = [self.save_upload(file) for file in files]
+
+        # a model server embeds in its own process, batched across callers
+        embedder = BulkEmbedder(self.embed_model, workers=0 if MODEL_SERVER_URL else INGEST_WORKERS)
+
+        ingest = self.ingests.start(
+            kb, paths, self.load_file, self.create_chunks,
+            lambda records: self.save_records(kb, records), embedder
+        )
+
+        return {"ingest_id": ingest["ingest_id"], "status": ingest["status"], "files": ingest["files"]}
+
+    def bulk_ingest_progress(self, ingest_id: str):
+        ingest = self.ingests.get(ingest_id)
+
+        if ingest is None:
+            raise HTTPException(status_code=404, detail="Ingest not found")
+
+        return ingest
+
+    # -------------------------------------------------
+    # SOURCES
+    # -------------------------------------------------
+    def update_source(self, kb, data, source_id, rec=None):
+        # only the chunks of this source are encoded again
+        if kb.tracks_sources():
+            kb.replace_source(source_id, self.create_chunks([rec]) if rec else [])
+        else:
+            # indexed before sources were tracked, rebuilt once
+            kb.rebuild(self.create_chunks(data))
+
+    def list_sources(self, namespace: Optional[str] = None):
+        kb = self.namespace_kb(namespace or DEFAULT_NAMESPACE)
+        kb.refresh()
+
+        return {"sources": [
+            {
+                "source_id": rec["source_id"],
+                "source_type": rec["source_type"],
+                "source_path": rec["source_path"],
+                "chunks": kb.source_chunks(rec["source_id"]) if kb.tracks_sources() else None
+            }
+            for rec in load_json(kb.folder)
+        ]}
+
+    def delete_source(self, source_id: str, namespace: Optional[str] = None):
+        kb = self.namespace_kb(namespace or DEFAULT_NAMESPACE)
+
+        # the index changes in the same order as knowledge.json
+        with editing_records(kb.folder) as data:
+            del data[find_source(data, source_id)]
+            self.update_source(kb, data, source_id)
+
+        return {"message": "Source removed from knowledge base"}
+
+    def replace_source(self, source_id: str, file: Optional[UploadFile] = File(None),
+                       namespace: Optional[str] = None):
+        kb = self.namespace_kb(namespace or DEFAULT_NAMESPACE)
+
+        # the new version is fetched before knowledge.json is locked
+        old = load_json(kb.folder)
+        old = old[find_source(old, source_id)]
+
+        if file is not None:
+            rec = self.load_file(self.save_upload(file))
+        elif old["source_type"] == "website":
+            try:
+                rec = scrape_website(old["source_path"])
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            raise HTTPException(status_code=400, detail="Upload the new version of this file")
+
+        rec["source_id"] = source_id
+        with editing_records(kb.folder) as data:
+            data[find_source(data, source_id)] = rec
+            self.update_source(kb, data, source_id, rec)
+
+        return {"message": "Source replaced", "chunks": kb.source_chunks(source_id)}
+
+    def scrape(self, req: URLRequest):
+        kb = self.namespace_kb(req.namespace or DEFAULT_NAMESPACE, create=True)
+
+        # pages are crawled before knowledge.json is locked
+        indexed = {rec["source_path"] for rec in load_json(kb.folder) if rec["source_type"] == "website"}
+
+        try:
+            with stage("scrape"):
+                pages = crawl(req.url, req.depth, os.path.join(kb.folder, "crawl_cache.json"), indexed)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if not pages:
+            raise HTTPException(status_code=400, detail="robots.txt disallows crawling this page")
+
+        added, updated = [], []
+        with editing_records(kb.folder) as data:
+            websites = {rec["source_path"]: i for i, rec in enumerate(data) if rec["source_type"] == "website"}
+
+            for page in pages:
+                if not page["changed"]:
+                    continue
+
+                rec = website_record(page)
+
+                if page["url"] in websites:
+                    i = websites[page["url"]]
+                    rec["source_id"] = data[i]["source_id"]
+                    data[i] = rec
+                    updated.append(rec)
+                else:
+                    websites[page["url"]] = len(data)
+                    data.append(rec)
+                    added.append(rec)
+
+            kb.add_chunks(self.create_chunks(added))
+            for rec in updated:
+                self.update_source(kb, data, rec["source_id"], rec)
+
+        return {
+            "message": "Website added to knowledge base",
+            "source_id": data[websites[req.url]]["source_id"],
+            "pages": len(pages),
+            "added": len(added),
+            "updated": len(updated),
+            "unchanged": len(pages) - len(added) - len(updated)
+        }
+
+    # -------------------------------------------------
+    # ASK
+    # -------------------------------------------------
+    def answer_questions(self, questions, kb, cache):
+        return answer_with_cache(cache, kb, questions, self.format_answer)
+
+    def ask(self, req: QuestionRequest):
+        names = selected_namespaces(req.namespace, req.namespaces)
+        kb = self.ensure_indexed(names)
+
+        answer, _, _ = self.answer_questions([req.question], kb, self.namespaces.cache(names))[0]
+
+        return {"answer": answer}
+
+    def ask_batch(self, req: BatchQuestionRequest):
+        if len(req.questions) > MAX_BATCH_QUESTIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch"
+            )
+
+        names = selected_namespaces(req.namespace, req.namespaces)
+        kb = self.ensure_indexed(names)
+
+        start = time.perf_counter()
+
+        results = [
+            {
+                "question": question,
+                "answer": answer,
+                "cached": tier,
+                "time_ms": round(ms, 3)
+            }
+            for question, (answer, tier, ms) in zip(
+                req.questions, self.answer_questions(req.questions, kb, self.namespaces.cache(names))
+            )
+        ]
+
+        return {
+            "answers": results,
+            "total_ms": round((time.perf_counter() - start) * 1000, 3)
+        }
+
+    def cache_stats(self, namespace: Optional[str] = None):
+        names = selected_namespaces(namespace)
+        for name in names:
+            self.namespace_kb(name)
+
+        return self.namespaces.cache(names).stats()
+
+    def set_vector_storage(self, req: StorageRequest):
+        kb = self.namespace_kb(req.namespace or DEFAULT_NAMESPACE)
+
+        try:
+            kb.set_storage(req.storage)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        return {"storage": kb.storage, "vectors": len(kb)}
+
+    # -------------------------------------------------
+    # GENERATION
+    # -------------------------------------------------
+    def generation_prompt(self, kb, difficulty, mode, topic=None, structured=False):
+        count_tokens = self.backend.count_tokens
+
+        template_tokens = count_tokens([build_prompt("", difficulty, mode, structured)])[0]
+        if structured:
+            max_new_tokens = self.backend.structured_max_new_tokens
+        else:
+            max_new_tokens = self.backend.max_new_tokens
+        budget = context_budget(self.backend.context_size, max_new_tokens, template_tokens)
+
+        with stage("context_packing"):
+            combined = select_context(kb, budget, count_tokens, topic)
+
+        return build_prompt(combined, difficulty, mode, structured)
+
+    def generate_material(self, prompt, mode, structured=False):
+        if not structured:
+            return self.generate(prompt)
+
+        material = parse_structured(self.generate(prompt, schema=material_schema(mode)))
+
+        if material is None:
+            raise HTTPException(status_code=502, detail="Generation stopped before the JSON was complete")
+
+        return material
+
+    def generate_for(self, req, mode):
+        kb = self.ensure_indexed(selected_namespaces(req.namespace, req.namespaces))
+
+        # the prompt is packed before waiting for the model
+        prompt = self.generation_prompt(kb, req.difficulty, mode, req.topic, req.structured)
+        with self.jobs.interactive():
+            return self.generate_material(prompt, mode, req.structured)
+
+    def worksheet(self, req: GenerateRequest):
+        return {"worksheet": self.generate_for(req, "worksheet")}
+
+    def assessment(self, req: GenerateRequest):
+        return {"assessment": self.generate_for(req, "assessment")}
+
+    def job_prompt(self, spec):
+        kb = self.ensure_indexed(selected_namespaces(spec.get("namespace"), spec.get("namespaces")))
+
+        return self.generation_prompt(
+            kb, spec["difficulty"], spec["mode"], spec["topic"], spec["structured"]
+        )
+
+    def create_job(self, req: JobRequest):
+        if not req.specs or len(req.specs) > MAX_JOB_SPECS:
+            raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_JOB_SPECS} specs per job")
+
+        for spec in req.specs:
+            if spec.mode not in MODES:
+                raise HTTPException(status_code=400, detail=f"Unknown mode: {spec.mode}")
+
+        job = self.jobs.submit([spec.dict() for spec in req.specs])
+
+        return {"job_id": job["job_id"], "status": job["status"], "specs": len(job["results"])}
+
+    def list_jobs(self):
+        return {"jobs": self.jobs.list()}
+
+    def get_job(self, job_id: str):
+        job = self.jobs.get(job_id)
+
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        return job
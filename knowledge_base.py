@@ -0,0 +1,837 @@
+import copy
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+
+import faiss
+import numpy as np
+
+from extractive import pack_vectors
+from lexical_index import LexicalIndex, Postings, reciprocal_rank_fusion
+from metrics import stage, timed
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process ingest lock on Windows, run a single worker there
+    fcntl = None
+
+
+# each retriever contributes this many ranked ids to the fusion step
+FUSION_DEPTH = 20
+
+# above this many chunks the dense search only scores BM25 candidates
+PREFILTER_MIN_CHUNKS = 50000
+PREFILTER_CANDIDATES = 2000
+
+# how embeddings are stored in the vector index, chosen per knowledge base:
+#   flat - exact float32 (4 bytes per dimension)
+#   fp16 - float16 scalar quantizer (2 bytes per dimension)
+#   sq8  - int8 scalar quantizer (1 byte per dimension)
+#   pq   - product quantizer (1 byte per PQ_DIMS_PER_CODE dimensions)
+STORAGE_TYPES = ("flat", "fp16", "sq8", "pq")
+DEFAULT_STORAGE = os.environ.get("VECTOR_STORAGE", "flat")
+
+# 8 dimensions per code would halve the codes again, and recall@10
+# with them (0.26 instead of 0.50 in benchmarks.quantization); faiss'
+# refine indexes rerank exactly but can't remove ids
+PQ_DIMS_PER_CODE = 4
+
+# trained quantizers stay exact float32 until this many vectors exist
+TRAIN_MIN_VECTORS = {"sq8": 1000, "pq": 10000}
+
+# older generations are kept so workers still opening them don't fail
+GENERATIONS_TO_KEEP = 3
+
+# spilled bulk ingest vectors are added to the index this many at a time
+BULK_ADD_ROWS = 8192
+
+# the chunk file is rewritten in the background once this share of
+# chunk ids belongs to removed sources
+COMPACT_DEAD_FRACTION = 0.25
+
+# memory-maps the codes of flat/SQ/PQ indexes (faiss >= 1.10), older
+# faiss versions only map IVF lists and read flat codes into memory
+VECTOR_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def new_vector_index(storage, dim):
+    if storage == "fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+
+    if storage == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+
+    if storage == "pq":
+        m = max(d for d in range(1, dim // PQ_DIMS_PER_CODE + 1) if dim % d == 0)
+        return faiss.IndexPQ(dim, m, 8)
+
+    return faiss.IndexFlatL2(dim)
+
+
+def id_mapped(index):
+    """
+    `index` as an IndexIDMap2 keyed by chunk id, so chunks can be
+    removed. Indexes written before that stored chunk i at position i.
+    """
+
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+
+    inner = faiss.clone_index(index)
+    inner.reset()
+
+    mapped = faiss.IndexIDMap2(inner)
+    if index.ntotal:
+        mapped.add_with_ids(
+            index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype="int64")
+        )
+
+    return mapped
+
+
+def requantize(index, storage):
+    index = id_mapped(index)
+    vectors = faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+
+    new_index = new_vector_index(storage, vectors.shape[1])
+    if not new_index.is_trained:
+        new_index.train(vectors)
+
+    mapped = faiss.IndexIDMap2(new_index)
+    mapped.add_with_ids(vectors, faiss.vector_to_array(index.id_map))
+
+    return mapped
+
+
+class ChunkStore:
+    """
+    Read-only sequence of chunk dicts stored as JSON lines.
+
+    The file is memory-mapped and `spans` holds the [start, end) byte
+    range of every chunk, so workers share the page cache and only
+    decode the chunks they actually return.
+
+    Chunk ids are never reused: a removed chunk keeps its id with a
+    (-1, -1) span, and len() counts only the remaining chunks.
+    """
+
+    def __init__(self, path=None, spans=None):
+        self.path = path
+        self.spans = spans if spans is not None else np.zeros((0, 2), dtype="int64")
+        self.live = int(np.count_nonzero(self.spans[:, 0] >= 0))
+        self._mm = None
+
+        if path and self.live:
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.live
+
+    def raw(self, i):
+        if i < 0:
+            i += len(self.spans)
+        if not 0 <= i < len(self.spans) or self.spans[i][0] < 0:
+            raise IndexError(i)
+
+        start, end = self.spans[i]
+        return self._mm[start:end]
+
+    def __getitem__(self, i):
+        return json.loads(self.raw(i))
+
+    def __iter__(self):
+        for i, (start, end) in enumerate(self.spans):
+            if start >= 0:
+                yield json.loads(self._mm[start:end])
+
+
+class Generation:
+    """
+    One published, immutable state of a knowledge base.
+    Ingest never modifies a generation, it publishes the next one.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.path = None
+        self.version = 0
+        self.storage = None
+        self.chunks_file = None
+        self.chunks = ChunkStore()
+        self.vector_index = None
+        self.lexical_index = LexicalIndex()
+        # {source_id: [[first chunk id, end], ...]}, None when built
+        # before sources were tracked
+        self.sources = {}
+
+    @classmethod
+    def open(cls, path):
+        gen = cls()
+        gen.path = path
+        gen.name = os.path.basename(path)
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        gen.version = meta["version"]
+        gen.storage = meta["storage"]
+        gen.chunks_file = meta["chunks_file"]
+
+        spans = np.load(os.path.join(path, "chunk_spans.npy"), mmap_mode="r")
+        chunks_path = os.path.join(os.path.dirname(os.path.dirname(path)), gen.chunks_file)
+        gen.chunks = ChunkStore(chunks_path, spans)
+
+        vector_path = os.path.join(path, "vector.index")
+        if os.path.exists(vector_path):
+            gen.vector_index = faiss.read_index(vector_path, VECTOR_MMAP_FLAGS)
+
+        gen.lexical_index = LexicalIndex.load(path, mmap=True)
+
+        sources_path = os.path.join(path, "sources.json")
+        if os.path.exists(sources_path):
+            with open(sources_path) as f:
+                gen.sources = json.load(f)
+        elif len(gen.chunks.spans):
+            gen.sources = None
+
+        return gen
+
+    def writable_vector_index(self):
+        # the mapped index is read-only, ingest works on a private copy
+        if self.vector_index is None:
+            return None
+        return faiss.read_index(os.path.join(self.path, "vector.index"))
+
+
+class Staging:
+    """
+    The next generation while ingest writes it: private copies of the
+    indexes, spans and sources of `gen`, published once complete.
+    """
+
+    def __init__(self, gen, default_storage):
+        self.storage = gen.storage or default_storage
+        self.chunks_file = gen.chunks_file or f"chunks-{gen.version + 1:08d}.jsonl"
+        self.spans = gen.chunks.spans
+        self.lexical = copy.copy(gen.lexical_index)
+
+        self.index = gen.writable_vector_index()
+        if self.index is not None:
+            self.index = id_mapped(self.index)
+
+        self.sources = None
+        if gen.sources is not None:
+            # ranges are extended in place, copied so the live generation keeps its own
+            self.sources = {k: [list(r) for r in v] for k, v in gen.sources.items()}
+
+    def remove_source(self, source_id):
+        # a source whose pages had no text never got a range
+        ranges = self.sources.pop(source_id, [])
+        if not ranges:
+            return
+
+        ids = np.concatenate([np.arange(first, end, dtype="int64") for first, end in ranges])
+
+        if self.index is not None:
+            self.index.remove_ids(ids)
+        self.lexical.remove(ids)
+
+        self.spans = np.array(self.spans)
+        self.spans[ids] = -1
+
+
+def extend_ranges(sources, chunks, start):
+    """Adds chunk ids from `start` on to the [first, end] ranges of their sources."""
+
+    for chunk_id, chunk in enumerate(chunks, start):
+        if chunk.get("source_id") is None:
+            continue
+        ranges = sources.setdefault(chunk["source_id"], [])
+        if ranges and ranges[-1][1] == chunk_id:
+            ranges[-1][1] = chunk_id + 1
+        else:
+            ranges.append([chunk_id, chunk_id + 1])
+
+
+class PendingChunks:
+    """
+    Chunks prepared for the index without the writer lock, numbered
+    from 0. Each batch is written to a spill folder as it arrives:
+    chunk JSON lines, float32 vectors and lexical postings. Only the
+    chunk spans, source ranges and vocabulary stay in memory.
+    """
+
+    def __init__(self, folder):
+        self.folder = tempfile.mkdtemp(prefix="pending-", dir=folder)
+        self.chunks_path = os.path.join(self.folder, "chunks.jsonl")
+        self.vectors_path = os.path.join(self.folder, "vectors.f32")
+        self.spans = []
+        self.dim = None
+        self.postings = Postings(self.folder)
+        self.sources = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, chunks, texts, embeddings):
+        spans = []
+
+        with open(self.chunks_path, "ab") as f:
+            pos = f.seek(0, os.SEEK_END)
+            for chunk in chunks:
+                line = json.dumps(chunk).encode("utf-8")
+                f.write(line + b"\n")
+                spans.append((pos, pos + len(line)))
+                pos += len(line) + 1
+
+        self.spans.append(np.asarray(spans, dtype="int64").reshape(-1, 2))
+
+        if embeddings is not None and len(embeddings):
+            embeddings = np.asarray(embeddings, dtype="float32")
+            self.dim = embeddings.shape[1]
+            with open(self.vectors_path, "ab") as f:
+                f.write(embeddings.tobytes())
+
+        self.postings.add(texts)
+        extend_ranges(self.sources, chunks, self.count)
+
+        self.count += len(chunks)
+
+    def vectors(self):
+        """The spilled vectors, memory-mapped."""
+
+        if self.dim is None:
+            return None
+        return np.memmap(self.vectors_path, dtype="float32", mode="r").reshape(-1, self.dim)
+
+    def close(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class KnowledgeBase:
+    """
+    Chunks of the knowledge base together with their FAISS vector
+    index and BM25 lexical index, persisted next to knowledge.json.
+
+    Both indexes are updated at ingest time so /ask only has to
+    encode the question and search.
+
+    Every ingest publishes a new generation under generations/ and
+    points CURRENT at it. Generations are memory-mapped read-only, so
+    several uvicorn workers share one copy of the vectors, postings
+    and chunk texts; each worker switches to a newer generation on
+    its next refresh().
+    """
+
+    def __init__(self, folder, embed_model, storage=DEFAULT_STORAGE):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage: {storage}")
+
+        self.folder = folder
+        self.embed_model = embed_model
+        self.default_storage = storage
+        self.lock = threading.Lock()
+
+        self.generation = Generation()
+        self._current_stat = None
+        self._compacting = False
+
+        os.makedirs(self._path("generations"), exist_ok=True)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.generation.chunks)
+
+    def _path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    @property
+    def chunks(self):
+        return self.generation.chunks
+
+    @property
+    def vector_index(self):
+        return self.generation.vector_index
+
+    @property
+    def lexical_index(self):
+        return self.generation.lexical_index
+
+    @property
+    def version(self):
+        return self.generation.version
+
+    @property
+    def storage(self):
+        # an existing knowledge base keeps the storage it was built with
+        return self.generation.storage or self.default_storage
+
+    # -------------------------------------------------
+    # GENERATIONS
+    # -------------------------------------------------
+    def refresh(self):
+        """
+        Switches to the newest published generation if CURRENT changed.
+        Only a stat() when nothing changed, so it runs on every request.
+        """
+
+        try:
+            st = os.stat(self._path("CURRENT"))
+        except FileNotFoundError:
+            return
+
+        key = (st.st_ino, st.st_mtime_ns)
+        if key == self._current_stat:
+            return
+
+        with open(self._path("CURRENT")) as f:
+            name = f.read().strip()
+
+        try:
+            self.generation = Generation.open(self._path("generations", name))
+        except FileNotFoundError:
+            # superseded and cleaned up while opening, the next call
+            # picks up the newer one
+            return
+
+        self._current_stat = key
+
+    @contextmanager
+    def _writing(self):
+        # one writer at a time across threads and worker processes
+        with ExitStack() as locks:
+            with stage("ingest_lock_wait"):
+                locks.enter_context(self.lock)
+                lock_file = locks.enter_context(open(self._path("ingest.lock"), "w"))
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            self.refresh()
+            yield
+
+    def _publish(self, vector_index, lexical_index, chunks_file, spans, storage, sources):
+        version = self.generation.version + 1
+        name = f"{version:08d}"
+
+        final_path = self._path("generations", name)
+        tmp_path = final_path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        if vector_index is not None:
+            faiss.write_index(vector_index, os.path.join(tmp_path, "vector.index"))
+
+        lexical_index.save(tmp_path)
+        np.save(os.path.join(tmp_path, "chunk_spans.npy"), spans)
+
+        if sources is not None:
+            with open(os.path.join(tmp_path, "sources.json"), "w") as f:
+                json.dump(sources, f)
+
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "version": version,
+                "storage": storage,
+                "chunks_file": chunks_file
+            }, f)
+
+        os.replace(tmp_path, final_path)
+
+        current_path = self._path("CURRENT")
+        with open(current_path + ".tmp", "w") as f:
+            f.write(name)
+        os.replace(current_path + ".tmp", current_path)
+
+        self.refresh()
+        self._remove_old_generations()
+
+    def _remove_old_generations(self):
+        names = sorted(
+            n for n in os.listdir(self._path("generations")) if not n.endswith(".tmp")
+        )
+        keep = names[-GENERATIONS_TO_KEEP:]
+
+        for name in names[:-GENERATIONS_TO_KEEP]:
+            shutil.rmtree(self._path("generations", name), ignore_errors=True)
+
+        used = set()
+        for name in keep:
+            with open(self._path("generations", name, "meta.json")) as f:
+                used.add(json.load(f)["chunks_file"])
+
+        for name in os.listdir(self.folder):
+            if name.startswith("chunks-") and name.endswith(".jsonl") and name not in used:
+                os.remove(self._path(name))
+
+    def _append_chunks(self, chunks_file, spans, chunks):
+        # chunk files are append-only and shared by consecutive generations
+        new_spans = []
+
+        with open(self._path(chunks_file), "ab") as f:
+            pos = f.seek(0, os.SEEK_END)
+
+            for chunk in chunks:
+                line = json.dumps(chunk).encode("utf-8")
+                f.write(line + b"\n")
+                new_spans.append((pos, pos + len(line)))
+                pos += len(line) + 1
+
+        return np.concatenate([spans, np.asarray(new_spans, dtype="int64").reshape(-1, 2)])
+
+    # -------------------------------------------------
+    # INGEST
+    # -------------------------------------------------
+    @timed("encode")
+    def encode(self, texts):
+        return np.asarray(self.embed_model.encode(texts), dtype="float32")
+
+    def encode_sentences(self, chunks):
+        """
+        Stores the vectors of each chunk's "sentences" in the chunk, so
+        answers only score the sentences of the retrieved chunks.
+        """
+
+        todo = [c for c in chunks if c.get("sentences") and "sentence_vectors" not in c]
+        if not todo:
+            return
+
+        vectors = self.encode([s for c in todo for s in c["sentences"]])
+
+        start = 0
+        for chunk in todo:
+            end = start + len(chunk["sentences"])
+            chunk["sentence_vectors"] = pack_vectors(vectors[start:end])
+            start = end
+
+    def add_chunks(self, chunks, embeddings=None):
+        """
+        Indexes new chunks and publishes them as the next generation.
+        Pass `embeddings` when the chunks are already encoded.
+        """
+
+        if not chunks:
+            return
+
+        texts = [c["text"] for c in chunks]
+        if embeddings is None:
+            embeddings = self.encode(texts)
+        self.encode_sentences(chunks)
+
+        with self._writing():
+            self._add(self.generation, chunks, texts, embeddings)
+
+    def rebuild(self, chunks):
+        texts = [c["text"] for c in chunks]
+        embeddings = self.encode(texts) if chunks else None
+        self.encode_sentences(chunks)
+
+        with self._writing():
+            empty = Generation()
+            empty.version = self.generation.version
+            empty.storage = self.storage
+            self._add(empty, chunks, texts, embeddings)
+
+    @timed("index_update")
+    def _add(self, gen, chunks, texts, embeddings, remove_source=None):
+        staged = Staging(gen, self.default_storage)
+
+        if remove_source is not None:
+            staged.remove_source(remove_source)
+        self._stage_chunks(staged, chunks, texts, embeddings)
+
+        self._publish_staged(staged)
+
+    def _stage_vectors(self, staged, start, embeddings):
+        if staged.index is None:
+            trained_later = staged.storage in TRAIN_MIN_VECTORS
+            staged.index = faiss.IndexIDMap2(new_vector_index(
+                "flat" if trained_later else staged.storage, embeddings.shape[1]
+            ))
+        staged.index.add_with_ids(
+            embeddings, np.arange(start, start + len(embeddings), dtype="int64")
+        )
+
+    def _stage_chunks(self, staged, chunks, texts, embeddings):
+        # ids continue after removed chunks, so they are never reused
+        start = len(staged.spans)
+
+        if embeddings is not None:
+            self._stage_vectors(staged, start, embeddings)
+
+        if chunks:
+            staged.lexical.add(range(start, start + len(chunks)), texts)
+
+        staged.spans = self._append_chunks(staged.chunks_file, staged.spans, chunks)
+
+        if staged.sources is not None:
+            extend_ranges(staged.sources, chunks, start)
+
+    def _publish_staged(self, staged):
+        index = staged.index
+
+        if (index is not None
+                and staged.storage in TRAIN_MIN_VECTORS
+                and isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+                and index.ntotal >= TRAIN_MIN_VECTORS[staged.storage]):
+            index = requantize(index, staged.storage)
+
+        self._publish(
+            index, staged.lexical, staged.chunks_file, staged.spans, staged.storage, staged.sources
+        )
+
+    def add_batches(self, batches):
+        """
+        Indexes (chunks, embeddings) batches as they arrive, e.g. from a
+        bulk ingest, and publishes them together as one generation.
+        Batches are encoded and tokenized without the writer lock and
+        spilled to disk as they complete, so memory doesn't grow with
+        the upload; other uploads only wait while everything is merged
+        into the indexes at the end.
+        """
+
+        pending = PendingChunks(self.folder)
+
+        try:
+            for chunks, embeddings in batches:
+                texts = [c["text"] for c in chunks]
+                if embeddings is None and chunks:
+                    embeddings = self.encode(texts)
+                self.encode_sentences(chunks)
+
+                pending.add(chunks, texts, embeddings)
+
+            if len(pending):
+                with self._writing():
+                    self._add_pending(pending)
+        finally:
+            pending.close()
+
+    @timed("bulk_index_update")
+    def _add_pending(self, pending):
+        staged = Staging(self.generation, self.default_storage)
+        start = len(staged.spans)
+
+        vectors = pending.vectors()
+        if vectors is not None:
+            # read from the spill file a slice at a time
+            for first in range(0, len(vectors), BULK_ADD_ROWS):
+                self._stage_vectors(
+                    staged, start + first, np.ascontiguousarray(vectors[first:first + BULK_ADD_ROWS])
+                )
+            del vectors
+
+        staged.lexical.add_postings(range(start, start + len(pending)), pending.postings)
+
+        with open(self._path(staged.chunks_file), "ab") as f, open(pending.chunks_path, "rb") as spill:
+            pos = f.seek(0, os.SEEK_END)
+            shutil.copyfileobj(spill, f)
+        staged.spans = np.concatenate([staged.spans] + [spans + pos for spans in pending.spans])
+
+        if staged.sources is not None:
+            for source_id, ranges in pending.sources.items():
+                target = staged.sources.setdefault(source_id, [])
+                for first, end in ranges:
+                    if target and target[-1][1] == start + first:
+                        target[-1][1] = start + end
+                    else:
+                        target.append([start + first, start + end])
+
+        self._publish_staged(staged)
+
+    def set_storage(self, storage):
+        """
+        Switches the knowledge base to another storage type, reusing the
+        stored vectors instead of re-encoding the chunks. Converting out
+        of a quantized type keeps its quantization error.
+        """
+
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage: {storage}")
+
+        with self._writing():
+            gen = self.generation
+            index = gen.writable_vector_index()
+
+            if index is not None:
+                too_few = index.ntotal < TRAIN_MIN_VECTORS.get(storage, 0)
+                index = requantize(index, "flat" if too_few else storage)
+
+            self.default_storage = storage
+            self._publish(
+                index, gen.lexical_index, gen.chunks_file, gen.chunks.spans, storage, gen.sources
+            )
+
+    # -------------------------------------------------
+    # SOURCES
+    # -------------------------------------------------
+    def tracks_sources(self):
+        """
+        False for a knowledge base built before sources were tracked;
+        rebuild() it before removing or replacing sources.
+        """
+
+        return self.generation.sources is not None
+
+    def has_source(self, source_id):
+        """False for unknown sources and sources without chunks."""
+
+        sources = self.generation.sources
+        return sources is not None and source_id in sources
+
+    def source_chunks(self, source_id):
+        ranges = (self.generation.sources or {}).get(source_id, [])
+        return sum(end - first for first, end in ranges)
+
+    def remove_source(self, source_id):
+        """Removes the chunks of a source. Nothing is re-encoded."""
+
+        self.replace_source(source_id, [])
+
+    def replace_source(self, source_id, chunks, embeddings=None):
+        """
+        Swaps the chunks of a source for `chunks` in one generation,
+        encoding only the new chunks. A source without chunks so far
+        just gets `chunks`.
+        """
+
+        texts = [c["text"] for c in chunks]
+        if embeddings is None and chunks:
+            embeddings = self.encode(texts)
+        self.encode_sentences(chunks)
+
+        with self._writing():
+            if not self.tracks_sources():
+                raise KeyError(source_id)
+
+            self._add(self.generation, chunks, texts, embeddings, remove_source=source_id)
+
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        spans = self.generation.chunks.spans
+        dead = len(spans) - self.generation.chunks.live
+
+        if not dead or dead < COMPACT_DEAD_FRACTION * len(spans):
+            return
+
+        with self.lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    @timed("compaction")
+    def compact(self):
+        """
+        Rewrites the chunk file without removed chunks. Chunk ids stay
+        the same, so neither index changes; both already dropped the
+        removed chunks.
+        """
+
+        with self._writing():
+            gen = self.generation
+            spans = np.array(gen.chunks.spans)
+            chunks_file = f"chunks-{gen.version + 1:08d}.jsonl"
+
+            with open(self._path(chunks_file), "wb") as f:
+                pos = 0
+                for i in np.flatnonzero(spans[:, 0] >= 0):
+                    line = gen.chunks.raw(i)
+                    f.write(line + b"\n")
+                    spans[i] = (pos, pos + len(line))
+                    pos += len(line) + 1
+
+            self._publish(
+                gen.writable_vector_index(), gen.lexical_index,
+                chunks_file, spans, gen.storage, gen.sources
+            )
+
+    # -------------------------------------------------
+    # SEARCH
+    # -------------------------------------------------
+    def _prefiltered_search(self, vector_index, q_emb, k, candidates):
+        selector = faiss.IDSelectorBatch(np.asarray(candidates, dtype="int64"))
+        params = faiss.SearchParameters(sel=selector)
+        D, I = vector_index.search(q_emb, k, params=params)
+
+        return [(int(i), float(d)) for i, d in zip(I[0], D[0]) if i >= 0]
+
+    def search(self, question, k=3):
+        return self.search_batch([question], k)[0]
+
+    def search_batch(self, questions, k=3, embeddings=None):
+        """
+        Ranks chunk ids for several questions at once: one encode call
+        and one multi-query FAISS search for the whole batch.
+        Pass `embeddings` when the questions are already encoded.
+        """
+
+        if not len(self.chunks) or not questions:
+            return [[] for _ in questions]
+
+        depth = max(k, FUSION_DEPTH)
+        q_embs = self.encode(questions) if embeddings is None else embeddings
+
+        return [
+            reciprocal_rank_fusion([[i for i, _ in d], [i for i, _ in l]])[:k]
+            for d, l in zip(*self.retrieve_batch(questions, depth, q_embs))
+        ]
+
+    def retrieve_batch(self, questions, depth, q_embs):
+        """
+        The rankings search_batch fuses, `depth` deep: (dense, lexical)
+        lists of [(chunk id, score)] per question. Dense scores are L2
+        distances (lower is better), lexical ones BM25 (higher is better).
+        """
+
+        # one consistent generation even if refresh() swaps it meanwhile
+        gen = self.generation
+
+        if not len(gen.chunks):
+            return [[] for _ in questions], [[] for _ in questions]
+
+        prefilter = len(gen.chunks) >= PREFILTER_MIN_CHUNKS
+
+        with stage("lexical_search"):
+            lexical = [
+                gen.lexical_index.search(q, PREFILTER_CANDIDATES if prefilter else depth)
+                for q in questions
+            ]
+
+        with stage("vector_search"):
+            if prefilter:
+                # no shared terms means nothing to prefilter on, search everything
+                dense = [
+                    self._prefiltered_search(
+                        gen.vector_index, q_embs[i:i + 1], depth, [doc_id for doc_id, _ in lexical[i]]
+                    )
+                    if lexical[i] else None
+                    for i in range(len(questions))
+                ]
+                full = [i for i, hits in enumerate(dense) if hits is None]
+                if full:
+                    D, I = gen.vector_index.search(q_embs[full], depth)
+                    for i, row, dist in zip(full, I, D):
+                        dense[i] = [(int(j), float(d)) for j, d in zip(row, dist) if j >= 0]
+            else:
+                D, I = gen.vector_index.search(q_embs, depth)
+                dense = [
+                    [(int(j), float(d)) for j, d in zip(row, dist) if j >= 0]
+                    for row, dist in zip(I, D)
+                ]
+
+        return dense, [l[:depth] for l in lexical]
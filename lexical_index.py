@@ -0,0 +1,269 @@
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does",
+    "for", "from", "how", "in", "is", "it", "of", "on", "or", "that", "the",
+    "this", "to", "was", "what", "when", "where", "which", "who", "why",
+    "with",
+}
+
+ARRAYS = ("offsets", "doc_ids", "tfs", "impacts", "idf", "doc_lengths")
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merges several ranked id lists into one.
+    Each list contributes 1 / (k + rank) per id, so ids ranked
+    well by more than one retriever float to the top.
+    """
+
+    scores = defaultdict(float)
+
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class Postings:
+    """
+    Documents tokenized for a LexicalIndex but not added yet, with
+    their own vocabulary, so they can be built up batch by batch
+    apart from the index and merged into it in one sort.
+    Documents are numbered in the order they are added. With
+    `folder` the postings are appended to files there instead of
+    kept in memory; only the vocabulary is.
+    """
+
+    PARTS = (("terms", "int32"), ("docs", "int32"), ("tfs", "float32"), ("lengths", "float32"))
+
+    def __init__(self, folder=None):
+        self.folder = folder
+        self.vocab = {}
+        self.parts = {name: [] for name, _ in self.PARTS}
+        self.count = 0
+
+    def _path(self, name):
+        return os.path.join(self.folder, f"postings.{name}")
+
+    def add(self, texts):
+        terms, docs, tfs, lengths = [], [], [], []
+
+        for doc, text in enumerate(texts, self.count):
+            counts = Counter(tokenize(text))
+
+            for term, tf in counts.items():
+                terms.append(self.vocab.setdefault(term, len(self.vocab)))
+                docs.append(doc)
+                tfs.append(tf)
+
+            lengths.append(sum(counts.values()))
+
+        for (name, dtype), values in zip(self.PARTS, (terms, docs, tfs, lengths)):
+            array = np.asarray(values, dtype=dtype)
+            if self.folder is None:
+                self.parts[name].append(array)
+            else:
+                with open(self._path(name), "ab") as f:
+                    f.write(array.tobytes())
+
+        self.count += len(lengths)
+
+    def arrays(self):
+        """Term ids, document numbers and term frequencies of every posting, and document lengths."""
+
+        if self.folder is None:
+            return tuple(
+                np.concatenate(self.parts[name]) if self.parts[name] else np.zeros(0, dtype=dtype)
+                for name, dtype in self.PARTS
+            )
+
+        return tuple(
+            np.fromfile(self._path(name), dtype=dtype) if os.path.exists(self._path(name))
+            else np.zeros(0, dtype=dtype)
+            for name, dtype in self.PARTS
+        )
+
+
+class LexicalIndex:
+    """
+    Inverted index with Okapi BM25 scoring.
+
+    Postings are stored as flat arrays sorted by term (CSR layout):
+    the postings of term t are doc_ids[offsets[t]:offsets[t + 1]].
+    Each posting carries its precomputed BM25 impact, so a query only
+    sums idf * impact over the postings of its own terms. The arrays
+    are saved as .npy files and can be memory-mapped read-only.
+
+    Doc ids are dense non-negative integers (chunk positions).
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.offsets = np.zeros(1, dtype="int64")
+        self.doc_ids = np.zeros(0, dtype="int64")
+        self.tfs = np.zeros(0, dtype="float32")
+        self.impacts = np.zeros(0, dtype="float32")
+        self.idf = np.zeros(0, dtype="float32")
+        self.doc_lengths = np.zeros(0, dtype="float32")
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_ids, texts):
+        """
+        Adds documents and recomputes the BM25 weights. Arrays are
+        replaced, never written in place, so memory-mapped ones work.
+        """
+
+        postings = Postings()
+        postings.add(texts)
+        self.add_postings(doc_ids, postings)
+
+    def add_postings(self, doc_ids, postings):
+        """
+        Adds tokenized documents, `doc_ids` in the order they were added
+        to `postings`. Every call re-sorts all postings of the index.
+        """
+
+        vocab = dict(self.vocab)
+        doc_ids = np.asarray(doc_ids, dtype="int64")
+
+        # the postings' own term ids in this index's vocabulary
+        term_ids = np.asarray(
+            [vocab.setdefault(term, len(vocab)) for term in postings.vocab], dtype="int64"
+        )
+        new_terms, new_docs, new_tfs, lengths = postings.arrays()
+
+        old_terms = np.repeat(
+            np.arange(len(self.offsets) - 1, dtype="int64"), np.diff(self.offsets)
+        )
+        terms = np.concatenate([old_terms, term_ids[new_terms]])
+        docs = np.concatenate([self.doc_ids, doc_ids[new_docs]])
+        tfs = np.concatenate([self.tfs, new_tfs])
+
+        order = np.argsort(terms, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype="int64")
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+
+        size = max(len(self.doc_lengths), int(doc_ids.max()) + 1 if len(doc_ids) else 0)
+        doc_lengths = np.zeros(size, dtype="float32")
+        doc_lengths[:len(self.doc_lengths)] = self.doc_lengths
+        doc_lengths[doc_ids] = lengths
+
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = docs[order]
+        self.tfs = tfs[order]
+        self.doc_lengths = doc_lengths
+        self._update_weights()
+
+    def remove(self, doc_ids):
+        """
+        Drops the postings of documents. Their ids are not reused, they
+        keep a zero length and no longer count towards BM25 statistics.
+        """
+
+        removed = np.zeros(len(self.doc_lengths), dtype=bool)
+        removed[np.asarray(doc_ids, dtype="int64")] = True
+
+        keep = ~removed[self.doc_ids]
+        terms = np.repeat(
+            np.arange(len(self.offsets) - 1, dtype="int64"), np.diff(self.offsets)
+        )[keep]
+
+        offsets = np.zeros(len(self.offsets), dtype="int64")
+        np.cumsum(np.bincount(terms, minlength=len(self.offsets) - 1), out=offsets[1:])
+
+        doc_lengths = np.array(self.doc_lengths)
+        doc_lengths[removed] = 0
+
+        self.offsets = offsets
+        self.doc_ids = self.doc_ids[keep]
+        self.tfs = self.tfs[keep]
+        self.doc_lengths = doc_lengths
+        self._update_weights()
+
+    def _update_weights(self):
+        # removed documents (and empty ones) have no postings to score
+        n = int(np.count_nonzero(self.doc_lengths))
+        avg = (float(self.doc_lengths.sum()) / n) if n else 1.0
+        avg = avg or 1.0
+
+        norms = self.k1 * (1 - self.b + self.b * self.doc_lengths / avg)
+        self.impacts = (
+            (self.k1 + 1) * self.tfs / (self.tfs + norms[self.doc_ids])
+        ).astype("float32")
+
+        df = np.diff(self.offsets).astype("float64")
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype("float32")
+
+    def search(self, query, k=10):
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return []
+
+        docs = []
+        weights = []
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs.append(self.doc_ids[start:end])
+            weights.append(self.impacts[start:end] * self.idf[t])
+
+        docs = np.concatenate(docs)
+        weights = np.concatenate(weights)
+
+        # cost depends on the postings of the query terms, not on corpus size
+        unique, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        return [(int(unique[i]), float(scores[i])) for i in top]
+
+    def save(self, folder):
+        with open(os.path.join(folder, "lexical.vocab.json"), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "vocab": self.vocab}, f)
+
+        for name in ARRAYS:
+            np.save(os.path.join(folder, f"lexical.{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        index = cls()
+
+        vocab_path = os.path.join(folder, "lexical.vocab.json")
+        if not os.path.exists(vocab_path):
+            return index
+
+        with open(vocab_path) as f:
+            data = json.load(f)
+
+        index.k1 = data["k1"]
+        index.b = data["b"]
+        index.vocab = data["vocab"]
+
+        for name in ARRAYS:
+            path = os.path.join(folder, f"lexical.{name}.npy")
+            setattr(index, name, np.load(path, mmap_mode="r" if mmap else None))
+
+        return index
@@ -0,0 +1,237 @@
+import functools
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# adds a Server-Timing header with the stage durations to every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+# /metrics wants "Authorization: Bearer $METRICS_TOKEN"; without a
+# token it is only served to clients on this machine
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+LOCAL_CLIENTS = ("127.0.0.1", "::1")
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120
+)
+
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    Prometheus histogram. Values are in seconds unless the name says
+    otherwise; `observe` takes one value per label name, in order.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            for values, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = _labels(self.labels, values, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _labels(self.labels, values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+
+        return "\n".join(lines)
+
+
+class Gauge:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.series[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+
+        with self.lock:
+            for values, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {value}")
+
+        return "\n".join(lines)
+
+
+# every metric of this process, in /metrics order
+REGISTRY = []
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, help, labels, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+
+def gauge(name, help, labels=()):
+    metric = Gauge(name, help, labels)
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+REQUEST_SECONDS = histogram(
+    "shiksha_request_seconds", "HTTP request latency.", ("method", "path", "status")
+)
+STAGE_SECONDS = histogram(
+    "shiksha_stage_seconds", "Time spent in each pipeline stage.", ("stage",)
+)
+QUEUE_WAIT_SECONDS = histogram(
+    "shiksha_queue_wait_seconds", "Time requests wait in a model server queue.", ("queue",)
+)
+GENERATION_TOKENS_PER_SECOND = histogram(
+    "shiksha_generation_tokens_per_second", "Generated tokens per second of each generation.",
+    ("backend",), TOKENS_PER_SECOND_BUCKETS
+)
+SPECULATIVE_ACCEPTANCE = histogram(
+    "shiksha_speculative_acceptance_ratio", "Share of drafted tokens accepted per generation.",
+    ("backend",), RATIO_BUCKETS
+)
+MODEL_LOAD_SECONDS = gauge(
+    "shiksha_model_load_seconds", "How long loading each model took.", ("model",)
+)
+
+
+# =========================================================
+# STAGES
+# =========================================================
+# (stage, seconds) of the request being handled, for Server-Timing
+_request_timings = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def timed(name):
+    """Decorator recording every call of the function as stage `name`."""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def server_timing(timings, total):
+    # repeated stages (one format_answer per question of /ask/batch) are summed
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0) + seconds
+    durations["total"] = total
+
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in durations.items())
+
+
+def metrics_allowed(request):
+    if METRICS_TOKEN:
+        given = request.headers.get("authorization", "")
+        return hmac.compare_digest(given.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+    return request.client is not None and request.client.host in LOCAL_CLIENTS
+
+
+def instrument(app):
+    """
+    Records the latency of every request of a FastAPI app and serves
+    all metrics of this process on GET /metrics. With several uvicorn
+    workers each scrape sees whichever worker answered it.
+    """
+
+    from fastapi import HTTPException, Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def record_request(request, call_next):
+        timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+
+        try:
+            response = await call_next(request)
+        finally:
+            _request_timings.reset(token)
+
+        elapsed = time.perf_counter() - start
+
+        # the route template, raw paths would make a series per URL
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, request.method, path, str(response.status_code))
+
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = server_timing(timings, elapsed)
+
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics(request: Request):
+        if not metrics_allowed(request):
+            raise HTTPException(status_code=403, detail="Metrics need METRICS_TOKEN")
+
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+    return app
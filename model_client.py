@@ -0,0 +1,115 @@
+import base64
+import http.client
+import json
+import os
+import socket
+import threading
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+# where model_server.py listens, e.g. unix:///tmp/shiksha-models.sock or
+# http://127.0.0.1:6100 - when unset every process loads its own models
+MODEL_SERVER_URL = os.environ.get("MODEL_SERVER_URL")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _never_reached_server(error, reused):
+    """
+    True if the request failed before the server could act on it, so
+    sending it again can't run it twice: the server refused the
+    connection, or a keep-alive connection it had already closed was
+    reset before any response byte. Timeouts are never retried, the
+    request may still be running.
+    """
+
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, ConnectionRefusedError):
+        return True
+    return reused and isinstance(
+        error, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+    )
+
+
+class ModelClient:
+    """
+    Client of the shared model server (model_server.py).
+
+    Drop-in for the embedding model (`encode`) and for LLMService
+    (`generate`, `count_tokens`), so callers don't know where the
+    models run.
+    Keeps one keep-alive connection per thread.
+    """
+
+    def __init__(self, url=MODEL_SERVER_URL, timeout=600):
+        self.url = urlparse(url)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connect(self):
+        if self.url.scheme == "unix":
+            return UnixHTTPConnection(self.url.path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+
+        for attempt in range(2):
+            conn = getattr(self.local, "conn", None)
+            reused = conn is not None
+            if not reused:
+                conn = self.local.conn = self._connect()
+
+            try:
+                conn.request(method, path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self.local.conn = None
+                if attempt or not _never_reached_server(e, reused):
+                    raise
+
+        if response.status != 200:
+            raise RuntimeError(f"Model server error {response.status}: {data.decode(errors='ignore')}")
+
+        return json.loads(data)
+
+    def _post(self, path, payload):
+        return self._request("POST", path, payload)
+
+    def info(self):
+        return self._request("GET", "/")
+
+    def encode(self, texts, **kwargs):
+        single = isinstance(texts, str)
+        result = self._post("/embed", {"texts": [texts] if single else list(texts)})
+
+        raw = base64.b64decode(result["data"])
+        embeddings = np.frombuffer(raw, dtype="float32").reshape(result["count"], result["dim"])
+
+        return embeddings[0] if single else embeddings
+
+    def count_tokens(self, texts):
+        return self._post("/tokenize", {"texts": list(texts)})["counts"]
+
+    def generate(self, prompt, max_tokens=700, schema=None):
+        payload = {"prompt": prompt, "max_tokens": max_tokens}
+        if schema is not None:
+            payload["schema"] = schema
+
+        return self._post("/generate", payload)["text"]
@@ -0,0 +1,202 @@
+import os
+
+# this process owns the models, it must never forward to a model server
+os.environ.pop("MODEL_SERVER_URL", None)
+
+import base64
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from fastapi import FastAPI
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import numpy as np
+
+from embedding_backends import EMBED_MODEL_NAME, EMBEDDING_BACKEND, get_embedder
+from generation_backends import get_backend
+from metrics import QUEUE_WAIT_SECONDS, instrument, timed
+from profiling import profile_requests
+
+
+# =========================================================
+# CONFIGURATION
+# =========================================================
+# "transformers" or "llama_cpp", see generation_backends.py
+LLM_BACKEND = os.environ.get("GENERATION_BACKEND", "transformers")
+
+# callers arriving within MAX_WAIT_MS of each other share one model call
+EMBED_MAX_BATCH = 256
+EMBED_MAX_WAIT_MS = 5
+GENERATE_MAX_BATCH = 4
+GENERATE_MAX_WAIT_MS = 20
+
+
+# =========================================================
+# REQUEST BATCHING
+# =========================================================
+class RequestBatcher:
+    """
+    Runs requests from concurrent callers through `run_batch` together.
+
+    Each caller submits a list of items and blocks until its results
+    are ready. A single worker thread drains the queue, waiting at most
+    `max_wait_ms` for more callers once the first one arrives, and
+    calls `run_batch` with up to `max_batch` items at a time. Queue
+    wait is recorded under `name`.
+    """
+
+    def __init__(self, name, run_batch, max_batch, max_wait_ms):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, items):
+        request = {"items": items, "done": threading.Event(), "queued": time.monotonic()}
+        self.queue.put(request)
+        request["done"].wait()
+
+        if "error" in request:
+            raise request["error"]
+        return request["results"]
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0]["items"])
+            deadline = time.monotonic() + self.max_wait
+
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request["items"])
+
+            now = time.monotonic()
+            for request in batch:
+                QUEUE_WAIT_SECONDS.observe(now - request["queued"], self.name)
+
+            items = [item for request in batch for item in request["items"]]
+
+            try:
+                results = self.run_batch(items)
+
+                pos = 0
+                for request in batch:
+                    request["results"] = results[pos:pos + len(request["items"])]
+                    pos += len(request["items"])
+
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+
+            for request in batch:
+                request["done"].set()
+
+
+# =========================================================
+# MODELS
+# =========================================================
+embed_model = get_embedder(EMBEDDING_BACKEND)
+
+llm = get_backend(LLM_BACKEND)
+
+
+@timed("embed_batch")
+def run_embed(texts):
+    return list(np.asarray(embed_model.encode(texts), dtype="float32"))
+
+
+@timed("generate_batch")
+def run_generate(items):
+    # requests asking for different lengths are generated separately,
+    # structured ones one at a time with their own grammar
+    results = [None] * len(items)
+    by_length = defaultdict(list)
+
+    for i, (prompt, max_tokens, schema) in enumerate(items):
+        if schema is not None:
+            results[i] = llm.generate_structured(prompt, schema, max_tokens)["text"]
+        else:
+            by_length[max_tokens].append(i)
+
+    for max_tokens, positions in by_length.items():
+        texts = llm.generate_batch([items[i][0] for i in positions], max_tokens)
+        for i, text in zip(positions, texts):
+            results[i] = text
+
+    return results
+
+
+embed_batcher = RequestBatcher("embed", run_embed, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS)
+generate_batcher = RequestBatcher("generate", run_generate, GENERATE_MAX_BATCH, GENERATE_MAX_WAIT_MS)
+
+
+# =========================================================
+# APP
+# =========================================================
+app = FastAPI(title="Local Model Server")
+instrument(app)
+profile_requests(app)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    max_tokens: int = 700
+    schema_: Optional[dict] = Field(None, alias="schema")
+
+
+class TokenizeRequest(BaseModel):
+    texts: List[str]
+
+
+@app.get("/")
+def home():
+    return {
+        "message": "Local Model Server Running",
+        "embedding_model": EMBED_MODEL_NAME,
+        "embedding_backend": EMBEDDING_BACKEND,
+        "llm_backend": LLM_BACKEND,
+        "context_size": llm.context_size,
+        "max_new_tokens": llm.max_new_tokens,
+        "structured_max_new_tokens": llm.structured_max_new_tokens
+    }
+
+
+@app.post("/embed")
+def embed(req: EmbedRequest):
+    vectors = embed_batcher.submit(req.texts) if req.texts else []
+    dim = embed_model.get_sentence_embedding_dimension()
+
+    data = np.asarray(vectors, dtype="float32").reshape(len(req.texts), dim)
+
+    return {
+        "count": len(req.texts),
+        "dim": dim,
+        "data": base64.b64encode(data.tobytes()).decode("ascii")
+    }
+
+
+@app.post("/tokenize")
+def tokenize(req: TokenizeRequest):
+    return {"counts": llm.count_tokens(req.texts) if req.texts else []}
+
+
+@app.post("/generate")
+def generate(req: GenerateRequest):
+    text = generate_batcher.submit([(req.prompt, req.max_tokens, req.schema_)])[0]
+    return {"text": text}
@@ -0,0 +1,164 @@
+import os
+import re
+import threading
+
+from answer_cache import AnswerCache
+from knowledge_base import FUSION_DEPTH, KnowledgeBase
+from lexical_index import reciprocal_rank_fusion
+
+
+DEFAULT_NAMESPACE = "default"
+
+# a teacher, class or subject, e.g. "teacher-12" or "class6_science"
+NAMESPACE_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def selected_namespaces(namespace=None, namespaces=None):
+    """Namespaces a request reads from: several merged, or a single one."""
+
+    if namespaces:
+        return list(dict.fromkeys(namespaces))
+    return [namespace or DEFAULT_NAMESPACE]
+
+
+class MergedChunks:
+    """Chunks of several knowledge bases, indexed by (position, chunk id)."""
+
+    def __init__(self, kbs):
+        self.kbs = kbs
+
+    def __len__(self):
+        return sum(len(kb.chunks) for kb in self.kbs)
+
+    def __getitem__(self, key):
+        n, i = key
+        return self.kbs[n].chunks[i]
+
+    def __iter__(self):
+        for kb in self.kbs:
+            yield from kb.chunks
+
+
+class MergedKnowledgeBase:
+    """
+    Read-only view searching several namespaces as one knowledge base.
+
+    Every namespace is searched on its own index; the merged top-k
+    fuses the union of their dense hits, ranked by distance, with the
+    union of their BM25 hits. Dense distances compare across
+    namespaces since all use the same embedding model.
+    """
+
+    def __init__(self, kbs):
+        self.kbs = kbs
+        self.chunks = MergedChunks(kbs)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def version(self):
+        return tuple(kb.version for kb in self.kbs)
+
+    def encode(self, texts):
+        return self.kbs[0].encode(texts)
+
+    def search(self, question, k=3):
+        return self.search_batch([question], k)[0]
+
+    def search_batch(self, questions, k=3, embeddings=None):
+        if not len(self.chunks) or not questions:
+            return [[] for _ in questions]
+
+        depth = max(k, FUSION_DEPTH)
+        q_embs = self.encode(questions) if embeddings is None else embeddings
+
+        retrieved = [kb.retrieve_batch(questions, depth, q_embs) for kb in self.kbs]
+
+        ranked = []
+        for q in range(len(questions)):
+            dense = sorted(
+                (d, (n, i)) for n, (hits, _) in enumerate(retrieved) for i, d in hits[q]
+            )
+            lexical = sorted(
+                (-s, (n, i)) for n, (_, hits) in enumerate(retrieved) for i, s in hits[q]
+            )
+
+            ranked.append(reciprocal_rank_fusion([
+                [key for _, key in dense[:depth]],
+                [key for _, key in lexical[:depth]]
+            ])[:k])
+
+        return ranked
+
+
+class Namespaces:
+    """
+    One knowledge base and answer cache per namespace, so a question
+    only searches the corpus it belongs to.
+
+    The default namespace lives directly in `folder`, where the single
+    knowledge base used to be; the others under folder/namespaces/.
+    """
+
+    def __init__(self, folder, embed_model, cache=AnswerCache):
+        self.folder = folder
+        self.embed_model = embed_model
+        self.new_cache = cache
+
+        self.lock = threading.Lock()
+        self.kbs = {}
+        self.caches = {}
+
+    def path(self, name):
+        if name == DEFAULT_NAMESPACE:
+            return self.folder
+        return os.path.join(self.folder, "namespaces", name)
+
+    def names(self):
+        folder = os.path.join(self.folder, "namespaces")
+        others = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+        return [DEFAULT_NAMESPACE] + [n for n in others if NAMESPACE_PATTERN.fullmatch(n)]
+
+    def get(self, name, create=False):
+        """
+        The knowledge base of a namespace. Raises ValueError for an
+        invalid name and KeyError for an unknown one unless `create`.
+        """
+
+        if not NAMESPACE_PATTERN.fullmatch(name):
+            raise ValueError(f"Invalid namespace: {name}")
+
+        with self.lock:
+            kb = self.kbs.get(name)
+            if kb is not None:
+                return kb
+
+            path = self.path(name)
+            if not create and name != DEFAULT_NAMESPACE and not os.path.isdir(path):
+                raise KeyError(name)
+
+            kb = self.kbs[name] = KnowledgeBase(path, self.embed_model)
+            return kb
+
+    def cache(self, names):
+        """
+        The answer cache of a set of namespaces. Raises like get() for
+        names that aren't namespaces, so they don't each get a cache.
+        """
+
+        for name in names:
+            self.get(name)
+
+        key = tuple(names)
+
+        with self.lock:
+            cache = self.caches.get(key)
+            if cache is None:
+                cache = self.caches[key] = self.new_cache()
+            return cache
+
+
+def merge(kbs):
+    return kbs[0] if len(kbs) == 1 else MergedKnowledgeBase(kbs)
@@ -0,0 +1,127 @@
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# requests carrying this token in an X-Profile-Token header or a
+# ?profile= query parameter are profiled; unset, nothing is installed
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# under CPU load the GIL switch interval (5 ms) caps the real rate
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "1"))
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread each `interval` seconds.
+
+    Sampling all threads, rather than profiling the calling one like
+    cProfile, also catches sync endpoints that FastAPI runs in its
+    threadpool.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+
+                self.samples[tuple(reversed(stack))] += 1
+
+    def folded(self, root=None):
+        """
+        Samples as folded stacks (flamegraph.pl, speedscope, inferno).
+        With `root`, only stacks running that code object, starting there.
+        """
+
+        folded = Counter()
+        for stack, count in self.samples.items():
+            if root is not None:
+                if root not in stack:
+                    continue
+                stack = stack[stack.index(root):]
+
+            folded[";".join(_frame_label(c) for c in stack)] += count
+
+        return "".join(f"{stack} {count}\n" for stack, count in folded.most_common())
+
+
+def profile_requests(app):
+    """
+    Profiles single requests of a FastAPI app on demand. The samples
+    of the endpoint are written to PROFILE_DIR and the file name is
+    returned in an X-Profile-File header. One profile runs at a time,
+    other flagged requests are served unprofiled meanwhile.
+    """
+
+    if not PROFILE_TOKEN:
+        return app
+
+    expected = PROFILE_TOKEN.encode()
+    busy = threading.Lock()
+
+    @app.middleware("http")
+    async def profile_request(request, call_next):
+        token = request.headers.get("x-profile-token") or request.query_params.get("profile")
+
+        if not token or not hmac.compare_digest(token.encode(), expected):
+            return await call_next(request)
+
+        if not busy.acquire(blocking=False):
+            return await call_next(request)
+
+        try:
+            profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000)
+            profiler.start()
+            try:
+                response = await call_next(request)
+            finally:
+                profiler.stop()
+        finally:
+            busy.release()
+
+        # concurrent requests run in other threads, keep only this endpoint
+        route = request.scope.get("route")
+        endpoint = getattr(getattr(route, "endpoint", None), "__code__", None)
+
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{request.url.path}"
+        path = os.path.join(PROFILE_DIR, re.sub(r"[^\w.-]+", "_", name) + ".folded")
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(profiler.folded(endpoint))
+
+        response.headers["X-Profile-File"] = path
+        return response
+
+    return app
@@ -0,0 +1,131 @@
+"""
+AnswerCache tiers and answer_with_cache against a stand-in knowledge
+base whose questions embed to fixed vectors:
+
+    python -m pytest tests
+"""
+
+import numpy as np
+
+from answer_cache import AnswerCache, answer_with_cache, normalize_question
+
+
+VECTORS = {
+    "what is photosynthesis": [1.0, 0.0, 0.0],
+    "explain photosynthesis": [0.99, 0.1, 0.0],
+    "what is gravity": [0.0, 1.0, 0.0],
+    "define gravity": [0.6, 0.8, 0.0],
+    "who wrote hamlet": [0.0, 0.0, 1.0],
+}
+
+
+class FakeKB:
+
+    def __init__(self):
+        self.version = 1
+        self.searched = []
+
+    def encode(self, texts):
+        return np.asarray([VECTORS[normalize_question(t)] for t in texts], dtype="float32")
+
+    def search_batch(self, questions, k=3, embeddings=None):
+        self.searched += questions
+        return [[n] for n in range(len(questions))]
+
+
+def format_answer(chunk_ids, kb, embedding):
+    return f"answer {kb.version}: {np.round(embedding, 2).tolist()}"
+
+
+def ask(cache, kb, *questions):
+    return answer_with_cache(cache, kb, list(questions), format_answer)
+
+
+def tiers(results):
+    return [tier for _, tier, _ in results]
+
+
+def test_exact_then_semantic_then_miss():
+    cache, kb = AnswerCache(), FakeKB()
+
+    first = ask(cache, kb, "What is photosynthesis?")
+    assert tiers(first) == [None]
+
+    # same question after normalization, then a close paraphrase
+    results = ask(cache, kb, "what is PHOTOSYNTHESIS", "Explain photosynthesis.")
+    assert tiers(results) == ["exact", "semantic"]
+    assert results[0][0] == results[1][0] == first[0][0]
+    assert kb.searched == ["What is photosynthesis?"]
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 2 / 3
+
+
+def test_semantic_threshold():
+    kb = FakeKB()
+
+    # cosine("what is gravity", "define gravity") is 0.8
+    strict = AnswerCache(threshold=0.95)
+    ask(strict, kb, "what is gravity")
+    assert tiers(ask(strict, kb, "define gravity")) == [None]
+
+    loose = AnswerCache(threshold=0.8)
+    ask(loose, kb, "what is gravity")
+    assert tiers(ask(loose, kb, "define gravity")) == ["semantic"]
+
+    # unrelated questions never match
+    assert tiers(ask(loose, kb, "who wrote hamlet")) == [None]
+
+
+def test_version_change_invalidates():
+    cache, kb = AnswerCache(), FakeKB()
+    ask(cache, kb, "what is gravity")
+
+    kb.version = 2
+    results = ask(cache, kb, "what is gravity", "define gravity")
+
+    assert tiers(results) == [None, None]
+    assert results[0][0].startswith("answer 2")
+    assert cache.stats()["version"] == 2
+    assert cache.stats()["exact_entries"] == 2
+
+
+def test_put_for_an_older_version_is_dropped():
+    cache = AnswerCache()
+    cache.get("q", 2)
+
+    # computed against version 1 while version 2 was published
+    cache.put("q", [1.0, 0.0, 0.0], "stale", 1)
+
+    assert cache.get("q", 2) is None
+    assert cache.get_similar([1.0, 0.0, 0.0], 2) is None
+
+
+def test_exact_tier_is_lru():
+    cache = AnswerCache(exact_size=2, semantic_size=0)
+
+    cache.put("a", None, "A", None)
+    cache.put("b", None, "B", None)
+    assert cache.get("a", None) == "A"
+
+    # "b" is now the least recently used
+    cache.put("c", None, "C", None)
+
+    assert cache.get("b", None) is None
+    assert cache.get("a", None) == "A"
+    assert cache.get("c", None) == "C"
+    assert cache.stats()["exact_entries"] == 2
+
+
+def test_semantic_tier_overwrites_the_oldest():
+    cache = AnswerCache(exact_size=0, semantic_size=2)
+
+    cache.put("x", [1.0, 0.0, 0.0], "X", None)
+    cache.put("y", [0.0, 1.0, 0.0], "Y", None)
+    cache.put("z", [0.0, 0.0, 1.0], "Z", None)
+
+    assert cache.stats()["semantic_entries"] == 2
+    assert cache.get_similar([1.0, 0.0, 0.0], None) is None
+    assert cache.get_similar([0.0, 1.0, 0.0], None) == "Y"
+    assert cache.get_similar([0.0, 0.0, 2.0], None) == "Z"
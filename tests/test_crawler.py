@@ -0,0 +1,87 @@
+"""
+Crawls a small site served by http.server on localhost:
+
+    python -m pytest tests
+"""
+
+import functools
+import http.server
+import threading
+
+import pytest
+
+from crawler import crawl, normalize_url
+
+
+PAGES = {
+    "index.html": """
+        <p>Home</p>
+        <a href="/">home</a> <a href="index.html">again</a>
+        <a href="a.html">a</a> <a href="a.html#part">a, part</a>
+        <a href="sub/">sub</a> <a href="sub">sub, no slash</a>
+        <a href="/private/p.html">private</a>
+        <a href="notes.pdf">pdf</a>
+        <a href="http://elsewhere.invalid/x.html">elsewhere</a>
+    """,
+    "a.html": "<p>Page A</p><a href='/index.html'>home</a>",
+    "sub/index.html": "<p>Sub</p><a href='page.html'>page</a> <a href='../a.html'>a</a>",
+    "sub/page.html": "<p>Sub page</p>",
+    "private/p.html": "<p>Private</p>",
+    "notes.pdf": "%PDF-1.4",
+    "robots.txt": "User-agent: *\nDisallow: /private/\n",
+}
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path):
+    for name, body in PAGES.items():
+        path = tmp_path / "site" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(body)
+
+    handler = functools.partial(QuietHandler, directory=str(tmp_path / "site"))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_normalize_url():
+    assert normalize_url("HTTP://Example.com:80/docs/index.html#top") == "http://example.com/docs"
+    assert normalize_url("https://example.com/docs/") == "https://example.com/docs"
+    assert normalize_url("https://example.com:8443") == "https://example.com:8443/"
+    assert normalize_url("https://example.com/a?page=2") == "https://example.com/a?page=2"
+
+
+def test_crawl_follows_allowed_same_host_html_once(site):
+    pages = crawl(site + "/", depth=2)
+
+    urls = [normalize_url(p["url"]) for p in pages]
+    assert sorted(urls) == sorted({site + "/", site + "/a.html", site + "/sub", site + "/sub/page.html"})
+    assert all(p["changed"] and p["content"] for p in pages)
+
+
+def test_single_page_ignores_robots(site):
+    pages = crawl(site + "/private/p.html")
+
+    assert [p["content"] for p in pages] == ["Private"]
+
+
+def test_recrawl_is_conditional(site, tmp_path):
+    cache_path = str(tmp_path / "crawl-cache.json")
+
+    first = crawl(site + "/", depth=2, cache_path=cache_path)
+    second = crawl(site + "/", depth=2, cache_path=cache_path, indexed=[p["url"] for p in first])
+
+    assert [p["url"] for p in second] == [p["url"] for p in first]
+    assert not any(p["changed"] for p in second)
+    assert all(p["content"] is None for p in second)
@@ -0,0 +1,164 @@
+"""
+Adds, replaces and removes sources of a KnowledgeBase encoded by a
+small hashing embedder, no model needed:
+
+    python -m pytest tests
+"""
+
+import os
+import re
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+import knowledge_base
+from knowledge_base import KnowledgeBase
+
+
+DIM = 64
+
+
+class HashingEmbedder:
+    """Bag of words hashed into DIM buckets, so shared words mean nearby vectors."""
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), DIM), dtype="float32")
+        for row, text in zip(vectors, texts):
+            for word in re.findall(r"\w+", text.lower()):
+                row[zlib.crc32(word.encode()) % DIM] += 1
+            row /= max(np.linalg.norm(row), 1)
+        return vectors
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+
+SOURCES = {
+    "plants": ["Photosynthesis turns sunlight into sugar.", "Leaves hold chlorophyll."],
+    "space": ["The moon orbits the earth.", "Mars is a red planet."],
+    "history": ["The printing press spread books.", "Rome built long roads."],
+    "math": ["Fractions divide a whole.", "Triangles have three sides."],
+    "music": ["A violin has four strings.", "Drums keep the beat."],
+}
+
+
+def make_chunks(source_id, texts):
+    return [
+        {"text": text, "source_id": source_id, "source_path": f"{source_id}.txt", "sentences": [text]}
+        for text in texts
+    ]
+
+
+def top_source(kb, question):
+    return kb.chunks[kb.search(question, k=1)[0]]["source_id"]
+
+
+def wait_for_compaction(kb):
+    deadline = time.monotonic() + 10
+    while kb._compacting:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def kb(tmp_path):
+    kb = KnowledgeBase(str(tmp_path / "kb"), HashingEmbedder())
+    for source_id, texts in SOURCES.items():
+        kb.add_chunks(make_chunks(source_id, texts))
+    return kb
+
+
+def test_add_replace_remove(kb):
+    assert len(kb) == 10
+    assert kb.tracks_sources()
+    assert kb.source_chunks("space") == 2
+    assert top_source(kb, "which planet is red") == "space"
+
+    kb.replace_source("space", make_chunks("space", ["Jupiter has a great red spot."]))
+
+    assert len(kb) == 9
+    assert kb.source_chunks("space") == 1
+    assert kb.chunks[kb.search("great red spot", k=1)[0]]["text"] == "Jupiter has a great red spot."
+    assert all(kb.chunks[i]["text"] != "Mars is a red planet." for i in kb.search("red planet", k=9))
+
+    kb.remove_source("space")
+
+    assert len(kb) == 8
+    assert not kb.has_source("space")
+    assert "space" not in {kb.chunks[i]["source_id"] for i in kb.search("red spot planet", k=8)}
+    assert top_source(kb, "chlorophyll in leaves") == "plants"
+
+
+def test_replace_unknown_source_adds_it(kb):
+    kb.replace_source("art", make_chunks("art", ["Paint mixes colours."]))
+
+    assert kb.source_chunks("art") == 1
+    assert top_source(kb, "mixing paint colours") == "art"
+
+
+def test_compacts_once_enough_chunks_are_removed(kb):
+    assert knowledge_base.COMPACT_DEAD_FRACTION == 0.25
+    chunks_file = kb.generation.chunks_file
+
+    # 2 of 10 chunks removed stays under the threshold
+    kb.remove_source("music")
+    wait_for_compaction(kb)
+    assert kb.generation.chunks_file == chunks_file
+
+    kb.remove_source("math")
+    wait_for_compaction(kb)
+    assert kb.generation.chunks_file != chunks_file
+
+    with open(os.path.join(kb.folder, kb.generation.chunks_file)) as f:
+        assert len(f.readlines()) == len(kb) == 6
+
+    # ids are kept, so both indexes still point at the right chunks
+    assert top_source(kb, "the printing press") == "history"
+    assert top_source(kb, "moon orbits") == "space"
+    assert kb.source_chunks("plants") == 2
+
+
+def test_second_instance_sees_published_changes(kb):
+    other = KnowledgeBase(kb.folder, HashingEmbedder())
+
+    assert other.version == kb.version
+    assert len(other) == 10
+    assert other.search("roads of rome") == kb.search("roads of rome")
+
+    kb.remove_source("history")
+    assert len(other) == 10
+
+    other.refresh()
+    assert len(other) == 8
+    assert not other.has_source("history")
+
+    # and writes through the second instance build on the first one's
+    other.add_chunks(make_chunks("art", ["Paint mixes colours."]))
+    kb.refresh()
+    assert len(kb) == 9
+    assert top_source(kb, "mixing paint colours") == "art"
+
+
+def test_legacy_knowledge_base_is_rebuilt(kb):
+    # built before sources were tracked: no sources.json
+    os.remove(os.path.join(kb.generation.path, "sources.json"))
+    legacy = KnowledgeBase(kb.folder, HashingEmbedder())
+
+    assert not legacy.tracks_sources()
+    with pytest.raises(KeyError):
+        legacy.remove_source("space")
+
+    # what the servers do on the first delete
+    legacy.rebuild([c for source_id, texts in SOURCES.items() if source_id != "space"
+                    for c in make_chunks(source_id, texts)])
+
+    assert legacy.tracks_sources()
+    assert len(legacy) == 8
+    assert not legacy.has_source("space")
+    assert legacy.source_chunks("plants") == 2
+
+    legacy.remove_source("plants")
+    assert len(legacy) == 6
+    assert top_source(legacy, "triangles have sides") == "math"
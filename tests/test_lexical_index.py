@@ -0,0 +1,127 @@
+"""
+BM25 ranking, removal and persistence of LexicalIndex:
+
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+
+from lexical_index import LexicalIndex, Postings, reciprocal_rank_fusion, tokenize
+
+
+DOCS = [
+    "The cell membrane controls what enters the cell.",
+    "Mitochondria release energy in the cell.",
+    "Volcanoes erupt molten rock called lava.",
+    "Lava cools into igneous rock.",
+    "Plants make energy from sunlight.",
+]
+
+
+@pytest.fixture
+def index():
+    index = LexicalIndex()
+    index.add(range(len(DOCS)), DOCS)
+    return index
+
+
+def ids(hits):
+    return [doc_id for doc_id, _ in hits]
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("What is the Cell's energy?") == ["cell", "s", "energy"]
+
+
+def test_ranking(index):
+    hits = index.search("cell energy")
+
+    # both terms, then the doc with "cell" twice, then "energy" alone
+    assert ids(hits) == [1, 0, 4]
+    assert hits[0][1] > hits[1][1] > hits[2][1] > 0
+
+    assert ids(index.search("lava rock")) in ([2, 3], [3, 2])
+    assert index.search("the of and") == []
+    assert index.search("unknownword") == []
+    assert len(index.search("cell energy lava rock", k=2)) == 2
+
+
+def test_add_postings_in_batches_matches_add(index):
+    postings = Postings()
+    postings.add(DOCS[:2])
+    postings.add(DOCS[2:])
+
+    batched = LexicalIndex()
+    batched.add_postings(range(len(DOCS)), postings)
+
+    for query in ["cell energy", "lava rock", "sunlight plants"]:
+        assert batched.search(query) == index.search(query)
+
+
+def test_spilled_postings_match_in_memory(tmp_path):
+    spilled = Postings(str(tmp_path))
+    spilled.add(DOCS)
+    memory = Postings()
+    memory.add(DOCS)
+
+    for a, b in zip(spilled.arrays(), memory.arrays()):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_add_to_existing_index(index):
+    index.add([5, 6], ["Igneous rock forms from lava.", "Energy drinks are not food."])
+
+    assert len(index) == 7
+    assert 5 in ids(index.search("igneous"))
+    assert set(ids(index.search("energy"))) == {1, 4, 6}
+
+
+def test_remove(index):
+    index.remove([1, 3])
+
+    assert len(index) == len(DOCS)
+    assert index.doc_lengths[1] == index.doc_lengths[3] == 0
+    assert ids(index.search("cell energy")) == [0, 4]
+    assert ids(index.search("igneous")) == []
+
+    # idf only counts the remaining documents
+    fresh = LexicalIndex()
+    fresh.add([0, 2, 4], [DOCS[0], DOCS[2], DOCS[4]])
+    for query in ["cell energy", "lava rock"]:
+        assert index.search(query) == pytest.approx(fresh.search(query))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(index, tmp_path, mmap):
+    index.remove([2])
+    index.save(str(tmp_path))
+
+    loaded = LexicalIndex.load(str(tmp_path), mmap=mmap)
+
+    assert loaded.vocab == index.vocab
+    assert len(loaded) == len(index)
+    for query in ["cell energy", "lava rock", "sunlight"]:
+        assert loaded.search(query) == index.search(query)
+
+    # memory-mapped arrays are read-only, later adds replace them
+    loaded.add([5], ["Lava lamps are not volcanoes."])
+    assert 5 in ids(loaded.search("lava"))
+
+
+def test_load_missing_is_empty(tmp_path):
+    index = LexicalIndex.load(str(tmp_path))
+
+    assert len(index) == 0
+    assert index.search("cell") == []
+
+
+def test_reciprocal_rank_fusion():
+    # ranked by both lists beats first in one, ties keep their first appearance
+    assert reciprocal_rank_fusion([[1, 2, 3], [4, 2, 5]]) == [2, 1, 4, 3, 5]
+    assert reciprocal_rank_fusion([[5, 6], []]) == [5, 6]
+    assert reciprocal_rank_fusion([]) == []
+
+    # a smaller k rewards the top ranks more than agreement
+    assert reciprocal_rank_fusion([[1, 2, 3], [4, 5, 3]])[0] == 3
+    assert reciprocal_rank_fusion([[1, 2, 3], [4, 5, 3]], k=0)[0] == 1